@@ -0,0 +1,296 @@
+""" PROJECT 2 AGGREGATE
+
+This module keeps statistics of the orders placed at each restaurant and for each cuisine: how many orders there were,
+and the mean and percentiles of their ratings, costs, preparation times and delivery times, separately for weekdays
+and weekends. They are built from the columns of the order history CSV the graph does not use, and kept up to date
+as orders are placed, so restaurants can be sorted by speed, price or weekend popularity without reading the CSV
+again.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import datetime
+import math
+import re
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from instrument import instrumented
+
+# The measures kept for every order, and the CSV column each is read from.
+MEASURES = {'rating': 'rating',
+            'cost': 'cost_of_the_order',
+            'preparation_time': 'food_preparation_time',
+            'delivery_time': 'delivery_time'}
+
+# The measures percentiles are kept for, and how many whole-number values each can take. Ratings are 0 to 5, costs are
+# in whole dollars and delivery times are in minutes, with anything larger than the last value counted as the last
+# value.
+HISTOGRAMS = {'rating': 6, 'cost': 101, 'delivery_time': 121}
+
+# What orders can be grouped by, and the CSV column each is read from.
+KINDS = {'restaurant': 'restaurant_name', 'cuisine': 'cuisine_type'}
+
+SEGMENTS = ('weekday', 'weekend')
+
+# The number at the start of a value. The CSV has values such as '21 #' that pandas cannot read as numbers.
+_NUMBER = r'^\s*(-?\d+(?:\.\d+)?)'
+
+
+def parse_statistic(statistic: str) -> tuple[str, Optional[float]]:
+    """Return the measure the given statistic is of, and its percentile, or None if it is a mean.
+
+    A statistic is 'orders' (the number of orders), the name of a measure (its mean), or the name of a measure with
+    percentiles followed by _p and the percentile.
+
+    Raise a ValueError if statistic is not one of these.
+
+    >>> parse_statistic('delivery_time')
+    ('delivery_time', None)
+    >>> parse_statistic('rating_p90')
+    ('rating', 90.0)
+    """
+    if statistic == 'orders' or statistic in MEASURES:
+        return statistic, None
+    match = re.fullmatch(r'(\w+)_p(\d+(?:\.\d+)?)', statistic)
+    if match is None or match.group(1) not in HISTOGRAMS or float(match.group(2)) > 100:
+        raise ValueError(f'unknown statistic {statistic!r}')
+    return match.group(1), float(match.group(2))
+
+
+def _numbers(column: pd.Series) -> np.ndarray:
+    """Return the number at the start of each value of the given column, or NaN where there is none."""
+    numbers = pd.to_numeric(column, errors='coerce').to_numpy(dtype=float, copy=True)
+    # Only the few values that are not plain numbers are searched for one, since that is much slower.
+    unread = np.isnan(numbers) & column.notna().to_numpy()
+    if unread.any():
+        numbers[unread] = pd.to_numeric(column[unread].astype(str).str.extract(_NUMBER, expand=False),
+                                        errors='coerce').to_numpy(dtype=float)
+    return numbers
+
+
+def _number(value: Any) -> Optional[float]:
+    """Return the number at the start of value, or None if there is none (e.g. 'Not given' or 'N/A')."""
+    match = re.match(_NUMBER, str(value))
+    return None if match is None else float(match.group(1))
+
+
+class _Table:
+    """The statistics of the orders of one kind of group (e.g. restaurants), one row per group, kept in NumPy arrays.
+
+    Every array is indexed by row first and segment (0 for weekdays, 1 for weekends) second.
+
+    Instance Attributes:
+        - rows: Maps each group to its row
+        - orders: The number of orders of each row and segment
+        - counts: The number of orders of each row and segment with each measure, in the order of MEASURES
+        - sums: The sum of each measure over those orders
+        - histograms: Maps each measure in HISTOGRAMS to the number of orders of each row and segment with each of its
+        values
+
+    Representation Invariants:
+        - all(0 <= row < len(self.rows) for row in self.rows.values())
+        - len(self.orders) >= len(self.rows)
+    """
+    rows: dict[str, int]
+    orders: np.ndarray
+    counts: np.ndarray
+    sums: np.ndarray
+    histograms: dict[str, np.ndarray]
+
+    def __init__(self, names: list[str], capacity: int = 16) -> None:
+        """Initialize a table with an empty row for each of the given groups, with room for at least capacity
+        rows."""
+        self.rows = {name: row for row, name in enumerate(names)}
+        capacity = max(capacity, len(names))
+        self.orders = np.zeros((capacity, 2), dtype=np.int64)
+        self.counts = np.zeros((capacity, 2, len(MEASURES)), dtype=np.int64)
+        self.sums = np.zeros((capacity, 2, len(MEASURES)))
+        self.histograms = {measure: np.zeros((capacity, 2, bins), dtype=np.int64)
+                           for measure, bins in HISTOGRAMS.items()}
+
+    def row(self, name: str) -> int:
+        """Return the row of the given group, adding an empty one first if it has none."""
+        row = self.rows.get(name)
+        if row is None:
+            row = len(self.rows)
+            if row == len(self.orders):
+                # Capacity is doubled, so adding a group costs O(1) amortized.
+                self.orders = self._grown(self.orders)
+                self.counts = self._grown(self.counts)
+                self.sums = self._grown(self.sums)
+                self.histograms = {measure: self._grown(histogram)
+                                   for measure, histogram in self.histograms.items()}
+            self.rows[name] = row
+        return row
+
+    @staticmethod
+    def _grown(array: np.ndarray) -> np.ndarray:
+        """Return a copy of array with twice as many rows, the new ones all zero."""
+        grown = np.zeros((2 * len(array),) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+
+class OrderStats:
+    """Statistics of the orders placed at each restaurant and for each cuisine.
+
+    Statistics are kept as running counts, sums and histograms, so adding an order and looking up any statistic of one
+    restaurant or cuisine take constant time. Percentiles are only kept for the measures in HISTOGRAMS, to the nearest
+    whole rating, dollar or minute. Orders are split by whether they were placed on a weekday or at the weekend; an
+    order whose day is not 'Weekend' counts as a weekday order.
+
+    Changing the statistics is not thread safe; GraphService.stats is guarded by the service's lock like its graph.
+    """
+    # Private Instance Attributes:
+    #     - _tables:
+    #         Maps each kind in KINDS to the table of its groups.
+    _tables: dict[str, _Table]
+
+    def __init__(self) -> None:
+        """Initialize statistics of no orders."""
+        self._tables = {kind: _Table([]) for kind in KINDS}
+
+    @classmethod
+    @instrumented('stats.from_orders')
+    def from_orders(cls, orders: pd.DataFrame) -> OrderStats:
+        """Return the statistics of the orders in the given DataFrame, which has the columns of the order history CSV.
+
+        The statistics are built with NumPy in a single pass per group kind, rather than by adding orders one at a time.
+        Values that are not numbers, and ratings outside 0 to 5, are left out of the statistics of their measure.
+
+        Preconditions:
+            - set(KINDS.values()).issubset(orders.columns)
+        """
+        stats = cls()
+        weekend = (orders['day_of_the_week'] == 'Weekend').to_numpy(dtype=np.int64) \
+            if 'day_of_the_week' in orders.columns else np.zeros(len(orders), dtype=np.int64)
+        values = {}
+        for measure, column in MEASURES.items():
+            values[measure] = _numbers(orders[column]) if column in orders.columns else np.full(len(orders), np.nan)
+        rating = values['rating']
+        rating[(rating < 0) | (rating > 5)] = np.nan
+
+        for kind, column in KINDS.items():
+            codes, names = pd.factorize(orders[column])
+            table = _Table(names.tolist())
+            size = 2 * len(names)
+            # Rows with no group name have code -1, and are left out.
+            grouped = codes >= 0
+            cells = codes[grouped] * 2 + weekend[grouped]
+            table.orders[:len(names)] = np.bincount(cells, minlength=size).reshape(-1, 2)
+            for i, measure in enumerate(MEASURES):
+                measured = values[measure][grouped]
+                known = ~np.isnan(measured)
+                table.counts[:len(names), :, i] = np.bincount(cells[known], minlength=size).reshape(-1, 2)
+                table.sums[:len(names), :, i] = np.bincount(cells[known], weights=measured[known],
+                                                            minlength=size).reshape(-1, 2)
+                if measure in HISTOGRAMS:
+                    bins = HISTOGRAMS[measure]
+                    bin_of = np.clip(np.rint(measured[known]), 0, bins - 1).astype(np.int64)
+                    table.histograms[measure][:len(names)] = np.bincount(
+                        cells[known] * bins + bin_of, minlength=size * bins).reshape(-1, 2, bins)
+            stats._tables[kind] = table
+        return stats
+
+    @classmethod
+    def from_csv(cls, filename: str) -> OrderStats:
+        """Return the statistics of the orders in the order history CSV with the given filename."""
+        columns = set(KINDS.values()) | set(MEASURES.values()) | {'day_of_the_week'}
+        return cls.from_orders(pd.read_csv(filename, usecols=lambda column: column in columns))
+
+    def add(self, restaurant: str, cuisine: str, rating: Any = 'N/A', cost: Any = None, preparation_time: Any = None,
+            delivery_time: Any = None, weekend: Optional[bool] = None) -> tuple:
+        """Add an order of the given cuisine at the given restaurant to the statistics.
+
+        Measures that are not given, or are not numbers, are left out. If weekend is None, the order is taken to have
+        been placed today.
+
+        Return the arguments the order was added with, with weekend filled in, so that it can be saved and added to
+        statistics built later with add(*order).
+        """
+        if weekend is None:
+            weekend = datetime.date.today().weekday() >= 5
+        segment = int(weekend)
+        measured = [_number(rating), _number(cost), _number(preparation_time), _number(delivery_time)]
+        if measured[0] is not None and not 0 <= measured[0] <= 5:
+            measured[0] = None
+        for kind, name in (('restaurant', restaurant), ('cuisine', cuisine)):
+            table = self._tables[kind]
+            row = table.row(name)
+            table.orders[row, segment] += 1
+            for i, (measure, value) in enumerate(zip(MEASURES, measured)):
+                if value is not None:
+                    table.counts[row, segment, i] += 1
+                    table.sums[row, segment, i] += value
+                    if measure in HISTOGRAMS:
+                        table.histograms[measure][row, segment, min(max(round(value), 0), HISTOGRAMS[measure] - 1)] += 1
+        return (restaurant, cuisine, rating, cost, preparation_time, delivery_time, bool(weekend))
+
+    def names(self, kind: str = 'restaurant') -> list[str]:
+        """Return the restaurants or cuisines (as given by kind) with at least one order, in no particular order."""
+        return list(self._table(kind).rows)
+
+    def value(self, name: str, statistic: str, kind: str = 'restaurant',
+              segment: Optional[str] = None) -> Optional[float]:
+        """Return the given statistic (see parse_statistic) of the orders at the restaurant or of the cuisine with the
+        given name, placed in the given segment ('weekday' or 'weekend'), or on any day if segment is None.
+
+        Return None if there are no such orders with the statistic's measure.
+
+        Raise a ValueError if statistic, kind or segment is not valid.
+        """
+        measure, percentile = parse_statistic(statistic)
+        table = self._table(kind)
+        if segment is None:
+            segments = slice(None)
+        elif segment in SEGMENTS:
+            segments = slice(SEGMENTS.index(segment), SEGMENTS.index(segment) + 1)
+        else:
+            raise ValueError(f'unknown segment {segment!r}')
+        row = table.rows.get(name)
+
+        if measure == 'orders':
+            return 0 if row is None else int(table.orders[row, segments].sum())
+        if row is None:
+            return None
+        i = list(MEASURES).index(measure)
+        count = int(table.counts[row, segments, i].sum())
+        if count == 0:
+            return None
+        if percentile is None:
+            return float(table.sums[row, segments, i].sum()) / count
+        # The nearest-rank percentile: the smallest value at least that percent of the orders are at or below.
+        cumulative = np.cumsum(table.histograms[measure][row, segments].sum(axis=0))
+        return float(np.searchsorted(cumulative, max(math.ceil(percentile / 100 * count), 1)))
+
+    def ranked(self, items: list, statistic: str, kind: str = 'restaurant', segment: Optional[str] = None,
+               descending: bool = False, name: Optional[Callable[[Any], str]] = None) -> list:
+        """Return the given items sorted by the given statistic (see value) of the restaurant or cuisine each is, or
+        that name returns for it. Items whose statistic is unknown come last, and ties keep their order.
+
+        Raise a ValueError if statistic, kind or segment is not valid.
+        """
+        parse_statistic(statistic)
+
+        def key(item: Any) -> tuple[bool, float]:
+            found = self.value(item if name is None else name(item), statistic, kind, segment)
+            if found is None:
+                return (True, 0.0)
+            return (False, -found if descending else found)
+
+        return sorted(items, key=key)
+
+    def _table(self, kind: str) -> _Table:
+        """Return the table of the given kind of group.
+
+        Raise a ValueError if kind is not in KINDS.
+        """
+        if kind not in self._tables:
+            raise ValueError(f'unknown kind {kind!r}')
+        return self._tables[kind]
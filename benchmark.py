@@ -0,0 +1,273 @@
+""" PROJECT 2 BENCHMARK
+
+This module generates synthetic order histories in the same format as food_order.csv, and times each stage of
+SavourSync on them at increasing sizes. Results are written as JSON lines so that runs can be compared over time: a
+first line describing the run, then one line per size, written as soon as that size finishes, so a long run can be
+watched or stopped without losing the sizes already done.
+
+Each size runs in a process of its own, which is stopped if it takes longer than the time limit (10 minutes by
+default). A size that is stopped is reported as timed out, and the larger sizes after it are skipped.
+
+Run it with, for example:
+
+    python benchmark.py --sizes 1000 10000 100000 --time-limit 300 --output results.jsonl
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+from aggregate import OrderStats
+from data import Graph, build_menu, load_snapshot, read_orders, source_tag
+from matrix import OrderMatrix
+from parallel import build_graph_parallel
+from similarity import SimilarGraph, recall
+from store import GraphStore
+
+CUISINES = ['American', 'Japanese', 'Italian', 'Chinese', 'Mexican', 'Indian', 'Middle Eastern', 'Mediterranean',
+            'Thai', 'French', 'Southern', 'Korean', 'Spanish', 'Vietnamese']
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+
+# The longest time, in seconds, a single size may run for by default.
+DEFAULT_TIME_LIMIT = 600.0
+
+
+def generate_orders(rows: int, customers: Optional[int] = None, restaurants: Optional[int] = None,
+                    cuisines: int = len(CUISINES), skew: float = 1.1, seed: int = 0) -> pd.DataFrame:
+    """Return a synthetic order history with the given number of rows, in the same columns as food_order.csv.
+
+    Restaurant popularity follows a Zipf-like distribution with exponent skew, so a few restaurants get most of the
+    orders, and each restaurant serves one or two cuisines. Customers and restaurants default to numbers that grow
+    with rows. The same seed always gives the same orders.
+
+    Preconditions:
+        - rows > 0
+        - customers is None or customers > 0
+        - restaurants is None or restaurants > 0
+        - 0 < cuisines <= len(CUISINES)
+        - skew >= 0
+    """
+    rng = np.random.default_rng(seed)
+    if customers is None:
+        customers = max(10, rows // 3)
+    if restaurants is None:
+        restaurants = max(20, rows // 500)
+
+    names = np.array([f'Restaurant {i}' for i in range(restaurants)], dtype=object)
+    served = np.array([rng.choice(cuisines, size=2, replace=cuisines == 1) for _ in range(restaurants)])
+    served_count = rng.integers(1, 3, size=restaurants)
+    popularity = 1.0 / np.arange(1, restaurants + 1) ** skew
+    popularity /= popularity.sum()
+
+    customer_ids = rng.choice(np.arange(1000, 1000 + customers * 10), size=customers, replace=False)
+    restaurant = rng.choice(restaurants, size=rows, p=popularity)
+    cuisine = served[restaurant, rng.integers(served_count[restaurant])]
+    rating = rng.choice(np.array(['3', '4', '5', 'Not given'], dtype=object), size=rows, p=[0.1, 0.2, 0.35, 0.35])
+    return pd.DataFrame({
+        'order_id': np.arange(1476547, 1476547 + rows),
+        'customer_id': customer_ids[rng.integers(customers, size=rows)],
+        'restaurant_name': names[restaurant],
+        'cuisine_type': np.array(CUISINES, dtype=object)[cuisine],
+        'cost_of_the_order': rng.uniform(4.47, 35.41, size=rows).round(2),
+        'day_of_the_week': np.where(rng.random(rows) < 0.71, 'Weekend', 'Weekday'),
+        'rating': rating,
+        'food_preparation_time': rng.integers(20, 36, size=rows),
+        'delivery_time': rng.integers(15, 34, size=rows)
+    })
+
+
+def _timed(stages: dict[str, float], stage: str, function: Callable[[], Any]) -> Any:
+    """Call function, record how many seconds it took under stage, and return its result."""
+    start = time.perf_counter()
+    result = function()
+    stages[stage] = time.perf_counter() - start
+    return result
+
+
+def run_size(rows: int, directory: str, seed: int = 0, samples: int = 100, workers: int = 1,
+             max_neighbours: Optional[int] = None, matrix: bool = False, **generator_options: Any) -> dict:
+    """Time every stage of SavourSync on a synthetic history with the given number of rows, and return the results.
+
+    Files are written to the given directory. Single-order matching and recommendations are averaged over the given
+    number of sampled users. If workers is more than 1, building and matching the graph with that many processes is
+    timed too. If max_neighbours is not None, matching with a SimilarGraph capped at that many neighbours is timed,
+    and its recall over the sampled users is reported. If matrix, matching and recommending with an OrderMatrix
+    (which needs scipy) are timed too.
+    """
+    filename = os.path.join(directory, f'orders_{rows}.csv')
+    generate_orders(rows, seed=seed, **generator_options).to_csv(filename, index=False)
+    stages = {}
+
+    orders = _timed(stages, 'csv_load', lambda: read_orders(filename))
+    graph = Graph()
+    _timed(stages, 'graph_build', lambda: graph.load_orders(orders))
+    _timed(stages, 'matching', graph.match_all)
+    if workers > 1:
+        _timed(stages, 'parallel_build', lambda: build_graph_parallel(orders, workers))
+    menu = _timed(stages, 'menu_build', lambda: build_menu(orders))
+    _timed(stages, 'menu_listing', graph.active_restaurants)
+    stats = _timed(stages, 'stats_build', lambda: OrderStats.from_csv(filename))
+    _timed(stages, 'menu_sorted', lambda: stats.ranked(graph.active_restaurants(), 'delivery_time_p90'))
+
+    rng = np.random.default_rng(seed)
+    users = list(graph.vertices)
+    sample = [users[i] for i in rng.choice(len(users), size=min(samples, len(users)), replace=False).tolist()]
+    popular = orders.groupby(['restaurant_name', 'cuisine_type']).size().idxmax()
+
+    def place_orders() -> None:
+        """Place the most popular order twice for a new user per sample, so that each one is matched."""
+        for i in range(len(sample)):
+            graph.add_vertex(-1 - i)
+            graph.record_order(-1 - i, popular[0], popular[1], 5)
+            graph.record_order(-1 - i, popular[0], popular[1], 5)
+
+    _timed(stages, 'single_order_matching', place_orders)
+    stages['single_order_matching'] /= max(len(sample), 1)
+    _timed(stages, 'explore', lambda: [graph.recommend(item, 10) for item in sample])
+    _timed(stages, 'explore_cached', lambda: [graph.recommend(item, 10) for item in sample])
+    stages['explore'] /= max(len(sample), 1)
+    stages['explore_cached'] /= max(len(sample), 1)
+
+    if matrix:
+        matched = Graph()
+        matched.load_orders(orders)
+        order_matrix = _timed(stages, 'matrix_build', lambda: OrderMatrix.from_graph(matched))
+        _timed(stages, 'matrix_matching', order_matrix.match)
+        _timed(stages, 'matrix_apply_matches', lambda: order_matrix.apply_matches(matched))
+        _timed(stages, 'matrix_explore', lambda: [order_matrix.recommend(item, 10) for item in sample])
+        _timed(stages, 'matrix_explore_two_hop', lambda: [order_matrix.recommend_two_hop(item, 10) for item in sample])
+        stages['matrix_explore'] /= max(len(sample), 1)
+        stages['matrix_explore_two_hop'] /= max(len(sample), 1)
+
+    similarity = {}
+    if max_neighbours is not None:
+        similar = SimilarGraph(max_neighbours)
+        similar.load_orders(orders)
+        _timed(stages, 'similarity_matching', similar.match_all)
+        _timed(stages, 'similarity_explore', lambda: [similar.recommend(item, 10) for item in sample])
+        stages['similarity_explore'] /= max(len(sample), 1)
+        similarity = {'similarity_matches': sum(len(vertex.neighbours) for vertex in similar.vertices.values()) // 2,
+                      'similarity_recall': recall(similar, sample)}
+
+    snapshot = os.path.join(directory, f'orders_{rows}.snapshot')
+    _timed(stages, 'snapshot_save', lambda: graph.save_snapshot(snapshot, menu, source_tag(filename)))
+    _timed(stages, 'snapshot_load', lambda: load_snapshot(snapshot, filename))
+    store = GraphStore(os.path.join(directory, f'orders_{rows}.db'))
+    _timed(stages, 'store_save_all', lambda: store.save_all(graph))
+    _timed(stages, 'store_load_all', lambda: store.load_all(Graph()))
+
+    return {'rows': rows,
+            'users': len(graph.vertices),
+            'restaurants': len(menu),
+            'matches': sum(len(vertex.neighbours) for vertex in graph.vertices.values()) // 2,
+            **similarity,
+            'seconds': stages}
+
+
+def _run_size_in_child(connection: Any, *args: Any, **kwargs: Any) -> None:
+    """Call run_size with the given arguments and send its result back through connection. Runs in a child process.
+    """
+    connection.send(run_size(*args, **kwargs))
+    connection.close()
+
+
+def _run_size_limited(time_limit: Optional[float], *args: Any, **kwargs: Any) -> Optional[dict]:
+    """Call run_size with the given arguments in a process of its own and return its result, or None if it did not
+    finish within time_limit seconds, in which case the process is stopped. None means no limit.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_run_size_in_child, args=(sender, *args), kwargs=kwargs, daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if receiver.poll(time_limit):
+            return receiver.recv()
+        return None
+    except EOFError:
+        raise RuntimeError(f'benchmarking {args[0]} rows failed; see the error above') from None
+    finally:
+        process.terminate()
+        process.join()
+        receiver.close()
+
+
+def run(sizes: list[int], seed: int = 0, samples: int = 100, workers: int = 1, max_neighbours: Optional[int] = None,
+        matrix: bool = False, time_limit: Optional[float] = DEFAULT_TIME_LIMIT,
+        **generator_options: Any) -> Iterator[dict]:
+    """Run the benchmark at each of the given sizes, yielding details of this machine first and then the results of
+    each size as soon as it finishes.
+
+    If time_limit is not None, each size runs in a process of its own and is stopped after that many seconds. It is
+    then reported as {'rows': ..., 'timed_out': True}, and every later size as {'rows': ..., 'skipped': True}, since
+    the sizes are expected to grow.
+
+    Preconditions:
+        - time_limit is None or time_limit > 0
+    """
+    yield {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'seed': seed,
+           'workers': workers,
+           'max_neighbours': max_neighbours,
+           'matrix': matrix,
+           'time_limit': time_limit,
+           'options': generator_options}
+    timed_out = False
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in sizes:
+            if timed_out:
+                yield {'rows': rows, 'skipped': True}
+                continue
+            args = (rows, directory, seed, samples, workers, max_neighbours, matrix)
+            if time_limit is None:
+                yield run_size(*args, **generator_options)
+                continue
+            result = _run_size_limited(time_limit, *args, **generator_options)
+            if result is None:
+                timed_out = True
+                result = {'rows': rows, 'timed_out': True}
+            yield result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time SavourSync on synthetic order histories.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of order rows')
+    parser.add_argument('--customers', type=int, default=None, help='number of customers (default: rows / 3)')
+    parser.add_argument('--restaurants', type=int, default=None, help='number of restaurants (default: rows / 500)')
+    parser.add_argument('--cuisines', type=int, default=len(CUISINES), help='number of cuisines')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of restaurant popularity')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=100, help='users sampled for per-user stages')
+    parser.add_argument('--workers', type=int, default=1, help='processes to also time a parallel build with')
+    parser.add_argument('--max-neighbours', type=int, default=None, help='also time similarity matching with this cap')
+    parser.add_argument('--matrix', action='store_true', help='also time the sparse matrix backend (needs scipy)')
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT,
+                        help='seconds each size may run for before it and the larger sizes are skipped (0: no limit)')
+    parser.add_argument('--output', default=None, help='file to write the JSON lines to (default: stdout)')
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.seed, args.samples, args.workers, args.max_neighbours, args.matrix,
+                 args.time_limit or None, customers=args.customers, restaurants=args.restaurants,
+                 cuisines=args.cuisines, skew=args.skew)
+    with (open(args.output, 'w') if args.output is not None else contextlib.nullcontext(sys.stdout)) as file:
+        for line in report:
+            file.write(json.dumps(line) + '\n')
+            file.flush()
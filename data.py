@@ -1,11 +1,30 @@
 from __future__ import annotations
+import ast
+import contextlib
 import csv
-from typing import Any, Union
+import functools
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+import hashlib
+import heapq
 import json
+import os
+import threading
 
 import networkx as nx
+import numpy as np
 import pandas as pd
 
+import instrument
+from aggregate import OrderStats
+from instrument import instrumented
+from search import RestaurantIndex
+
+# The first bytes of every graph snapshot file. Bump the version when the layout, or the types of the values in it,
+# change.
+SNAPSHOT_MAGIC = b'SAVSNAP3'
+# Every array in a snapshot file starts at a multiple of this many bytes, so it can be memory-mapped directly.
+_SNAPSHOT_ALIGNMENT = 64
+
 
 class _Vertex:
     """A vertex in the food delivery database, used to represent a single user.
@@ -18,33 +37,37 @@ class _Vertex:
          user gave the order. This dictionary stores info for orders that have been placed only once by the user.
         - repeated_orders: A mapping of a tuple containing the restaurant and cuisine of the order to the rating the
          user gave the order. This dictionary stores info for orders that have been placed repeatedly by the user.
-        - neighbours: The vertices that are adjacent to this vertex. These represent other users that have been
-        "matched" with this user
+        - neighbours: A mapping of the items of the vertices that are adjacent to this vertex to the cuisines of every
+        repeated order the two users share. These represent other users that have been "matched" with this user
 
     Representation Invariants:
-        - self not in self.neighbours
-        - all(self in u.neighbours for u in self.neighbours)
+        - self.item not in self.neighbours
+        - all(cuisines != () for cuisines in self.neighbours.values())
         - all(u not in self.repeated_orders for u in self.one_time_orders)
     """
+    __slots__ = ('item', 'one_time_orders', 'repeated_orders', 'neighbours')
     item: Any
     one_time_orders: dict[tuple[str, str], int]
     repeated_orders: dict[tuple[str, str], int]
-    neighbours: dict[_Vertex: Any]
+    neighbours: dict[Any, tuple[str, ...]]
 
-    def __init__(self, item: Any) -> None:
+    def __init__(self, item: Any, one_time_orders: Optional[dict] = None, repeated_orders: Optional[dict] = None,
+                 neighbours: Optional[dict] = None) -> None:
         """Initialize a new vertex with the given item and kind.
 
-        This vertex is initialized with no neighbours and no orders.
+        This vertex is initialized with no neighbours and no orders, unless they are given.
         """
         self.item = item
-        self.one_time_orders = {}
-        self.repeated_orders = {}
-        self.neighbours = {}
+        self.one_time_orders = one_time_orders if one_time_orders is not None else {}
+        self.repeated_orders = repeated_orders if repeated_orders is not None else {}
+        self.neighbours = neighbours if neighbours is not None else {}
 
-    def add_order(self, restaurant: str, cuisine: str, rating: Any = 'N/A') -> None:
+    def add_order(self, restaurant: str, cuisine: str, rating: Any = 'N/A') -> bool:
         """ Adds a new order to the users one_time_orders or repeated_orders, depending on whether the user has
         placed that order previously or not.
 
+        Return whether this order has just become one of the user's repeated orders.
+
         Preconditions:
             - restaurant != ''
             - cuisine != ''
@@ -55,23 +78,72 @@ class _Vertex:
         elif order in self.one_time_orders:
             self.repeated_orders[order] = rating
             self.one_time_orders.pop(order)
+            return True
         else:
             pass
+        return False
 
 
 class Graph:
     """A graph used to represent the food delivery network. It contains all the users in the network and keeps track of
     the matches.
+
+    Vertices use __slots__, and every (restaurant, cuisine) order is interned, so that all users that placed the same
+    order share one key tuple and one copy of each string instead of holding their own. Measured with tracemalloc on
+    benchmark.generate_orders(1_000_000, customers=200_000) (about 5 distinct orders per user), a user costs about 640
+    bytes, including their share of the repeated order index, plus about 130 bytes for every match.
+
+    Instance Attributes:
+        - restaurant_index: If not None, a search index of the restaurants at least one user has placed a repeated
+        order at, with each one's number of repeated orders as its popularity. It is kept up to date as repeated orders
+        are added and removed.
     """
+    restaurant_index: Optional[RestaurantIndex]
     # Private Instance Attributes:
     #     - _vertices:
     #         A collection of the vertices contained in this graph.
     #         Maps item to _Vertex object.
+    #     - _repeat_index:
+    #         An inverted index of the repeated orders in this graph.
+    #         Maps each (restaurant, cuisine) order to the set of items of the users that have repeated it.
+    #     - _orders:
+    #         The interned orders of this graph. Maps each (restaurant, cuisine) order to the one tuple that every
+    #         vertex uses as its key for that order.
+    #     - _restaurant_repeats:
+    #         Maps each restaurant to the number of repeated orders users have placed there. Restaurants with no
+    #         repeated orders are not keys.
+    #     - _active:
+    #         The keys of _restaurant_repeats in sorted order, or None if they have changed since it was last sorted.
+    #     - _recommendations:
+    #         Cached results of recommend. Maps a user's item to a mapping of each k recommend was called with to its
+    #         result. A user's entry is dropped whenever their orders or matches, or the orders of one of their
+    #         matches, change.
+    #     - _dirty:
+    #         The items of the users that were added or changed since take_dirty was last called.
     _vertices: dict[Any, _Vertex]
+    _repeat_index: dict[tuple[str, str], set]
+    _orders: dict[tuple[str, str], tuple[str, str]]
+    _restaurant_repeats: dict[str, int]
+    _active: Optional[list[str]]
+    _recommendations: dict[Any, dict[Optional[int], list]]
+    _dirty: set
 
     def __init__(self) -> None:
         """Initialize an empty graph (no vertices or edges)."""
         self._vertices = {}
+        self._repeat_index = {}
+        self._orders = {}
+        self._restaurant_repeats = {}
+        self._active = None
+        self._recommendations = {}
+        self._dirty = set()
+        self.restaurant_index = None
+
+    def intern_order(self, restaurant: str, cuisine: str) -> tuple[str, str]:
+        """Return the shared (restaurant, cuisine) tuple for the given order, interning it first if it is new.
+        """
+        order = (restaurant, cuisine)
+        return self._orders.setdefault(order, order)
 
     def add_vertex(self, item: Any) -> None:
         """Add a vertex with the given item to this graph.
@@ -83,9 +155,236 @@ class Graph:
         """
         if item not in self._vertices:
             self._vertices[item] = _Vertex(item)
+            self._dirty.add(item)
+
+    @instrumented('graph.add_order')
+    def add_order(self, item: Any, restaurant: str, cuisine: str, rating: Any = 'N/A') -> bool:
+        """Add an order to the user with the given item, keeping the repeated order index up to date.
+
+        Return whether this order has just become one of the user's repeated orders.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+
+        Preconditions:
+            - restaurant != ''
+            - cuisine != ''
+        """
+        if item in self._vertices:
+            self._forget_recommendations(item)
+            self._dirty.add(item)
+            restaurant, cuisine = self.intern_order(restaurant, cuisine)
+            if self._vertices[item].add_order(restaurant, cuisine, rating):
+                self._index_repeat(item, (restaurant, cuisine))
+                return True
+            return False
+        else:
+            raise ValueError
+
+    @instrumented('graph.record_order')
+    def record_order(self, item: Any, restaurant: str, cuisine: str, rating: Any = 'N/A') -> list:
+        """Add an order to the user with the given item and match them with the users they now share it with.
+
+        Return the items of the users that were newly matched with this user, in no particular order.
+
+        Only an order that has just become repeated can create matches, and only with the other users that have
+        repeated it, so the cost of this method depends on how popular the order is rather than on the size of the
+        graph.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+
+        Preconditions:
+            - restaurant != ''
+            - cuisine != ''
+        """
+        new_matches = []
+        if self.add_order(item, restaurant, cuisine, rating):
+            for other in self._repeat_index[(restaurant, cuisine)]:
+                if other != item:
+                    if not self.adjacent(item, other):
+                        new_matches.append(other)
+                    self.add_edge(other, item, cuisine)
+        if instrument.ENABLED:
+            instrument.count('graph.record_order.new_matches', len(new_matches))
+        return new_matches
+
+    @instrumented('graph.load_orders')
+    def load_orders(self, orders: pd.DataFrame) -> None:
+        """Add every order in the given DataFrame to this graph in a single pass.
+
+        The orders are classified with pandas instead of one row at a time: an order placed once by a customer is a
+        one time order rated with that row's rating, and an order placed more than once is a repeated order rated with
+        the rating of its second placement, exactly as if each row had been passed to add_order in turn.
+
+        Preconditions:
+            - {'customer_id', 'restaurant_name', 'cuisine_type', 'rating'}.issubset(orders.columns)
+        """
+        orders = orders.reset_index(drop=True)
+        one_time, repeated = classify_orders(orders)
+        self.load_classified_orders(orders['customer_id'].unique().tolist(), one_time, repeated)
+
+    def load_classified_orders(self, items: list, one_time: pd.DataFrame, repeated: pd.DataFrame) -> None:
+        """Add the given users, then the orders classify_orders split into one_time and repeated, to this graph.
+
+        Orders are added to each user in the order of their rows.
+        """
+        self._recommendations = {}
+        for item in items:
+            self.add_vertex(item)
+
+        for item, restaurant, cuisine, rating in zip(one_time['customer_id'].tolist(),
+                                                     one_time['restaurant_name'].tolist(),
+                                                     one_time['cuisine_type'].tolist(),
+                                                     one_time['rating'].tolist()):
+            self._vertices[item].one_time_orders[self.intern_order(restaurant, cuisine)] = rating
+        for item, restaurant, cuisine, rating in zip(repeated['customer_id'].tolist(),
+                                                     repeated['restaurant_name'].tolist(),
+                                                     repeated['cuisine_type'].tolist(),
+                                                     repeated['rating'].tolist()):
+            order = self.intern_order(restaurant, cuisine)
+            self._vertices[item].repeated_orders[order] = rating
+            self._index_repeat(item, order)
+
+    @instrumented('graph.remove_repeated_order')
+    def remove_repeated_order(self, item: Any, restaurant: str, cuisine: str) -> None:
+        """Remove the given order from the repeated orders of the user with the given item, if it is one.
+
+        The user's matches are left unchanged.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        if item in self._vertices:
+            self._recommendations.pop(item, None)
+            self._dirty.add(item)
+            if self._vertices[item].repeated_orders.pop((restaurant, cuisine), None) is not None:
+                self._unindex_repeat(item, (restaurant, cuisine))
+        else:
+            raise ValueError
+
+    def active_restaurants(self) -> list[str]:
+        """Return the restaurants that at least one user has placed a repeated order at, in sorted order.
+
+        The list is kept up to date as orders are added and removed, so it is only re-sorted after a restaurant has
+        gained its first repeated order or lost its last one.
+        """
+        if self._active is None:
+            self._active = sorted(self._restaurant_repeats, key=str)
+        return list(self._active)
+
+    def restaurant_repeats(self) -> dict[str, int]:
+        """Return a mapping from each restaurant that at least one user has placed a repeated order at to the number
+        of repeated orders placed there.
+        """
+        return dict(self._restaurant_repeats)
+
+    def _index_repeat(self, item: Any, order: tuple[str, str]) -> None:
+        """Record that the user with the given item has repeated the given order."""
+        users = self._repeat_index.setdefault(order, set())
+        if item not in users:
+            users.add(item)
+            count = self._restaurant_repeats.get(order[0], 0)
+            self._restaurant_repeats[order[0]] = count + 1
+            if count == 0:
+                self._active = None
+            if self.restaurant_index is not None:
+                self.restaurant_index.set_popularity(order[0], count + 1)
+
+    def _unindex_repeat(self, item: Any, order: tuple[str, str]) -> None:
+        """Record that the user with the given item no longer has the given order as a repeated order."""
+        users = self._repeat_index.get(order, set())
+        if item in users:
+            users.remove(item)
+            if not users:
+                self._repeat_index.pop(order)
+            self._restaurant_repeats[order[0]] -= 1
+            if self.restaurant_index is not None:
+                self.restaurant_index.set_popularity(order[0], self._restaurant_repeats[order[0]])
+            if self._restaurant_repeats[order[0]] == 0:
+                self._restaurant_repeats.pop(order[0])
+                self._active = None
+
+    @instrumented('graph.recommend')
+    def recommend(self, item: Any, k: Optional[int] = None) -> list[tuple[tuple[str, str], list, Optional[float]]]:
+        """Return the top k new orders the matches of the user with the given item have tried, best first.
+
+        A recommendation is an order that one of the user's matches has placed once, in a cuisine they were matched
+        on, and that the user has never placed. Each one is returned as a tuple of the (restaurant, cuisine) order,
+        the items of the matches that tried it, and the mean rating they gave it (or None if none of them rated it).
+        Orders tried by more matches come first, then orders with higher mean ratings. If k is None, every
+        recommendation is returned.
+
+        Results are cached until the user's orders or matches, or the orders of one of their matches, change, so
+        asking again for the same user is free.
 
+        Raise a ValueError if item does not appear as a vertex in this graph.
+
+        Preconditions:
+            - k is None or k >= 0
+        """
+        if item not in self._vertices:
+            raise ValueError
+        cached = self._recommendations.setdefault(item, {})
+        if k in cached:
+            if instrument.ENABLED:
+                instrument.count('graph.recommend.cache_hits')
+            return list(cached[k])
+
+        user = self._vertices[item]
+        tried = {}
+        for match, cuisines in user.neighbours.items():
+            for order, rating in self._vertices[match].one_time_orders.items():
+                if order[1] in cuisines and order not in user.one_time_orders and order not in user.repeated_orders:
+                    matches, rated, mean = tried.get(order, ([], 0, 0.0))
+                    matches.append(match)
+                    rating = _numeric_rating(rating)
+                    if rating is not None:
+                        rated += 1
+                        mean += (rating - mean) / rated
+                    tried[order] = (matches, rated, mean)
+
+        ranked = [(order, matches, mean if rated > 0 else None) for order, (matches, rated, mean) in tried.items()]
+
+        def rank(recommendation: tuple[tuple[str, str], list, Optional[float]]) -> tuple[int, float]:
+            """Return the key recommendations are ranked by."""
+            return len(recommendation[1]), -1.0 if recommendation[2] is None else recommendation[2]
+
+        if k is None:
+            ranked.sort(key=rank, reverse=True)
+        else:
+            ranked = heapq.nlargest(k, ranked, key=rank)
+        cached[k] = ranked
+        return list(ranked)
+
+    def _forget_recommendations(self, item: Any) -> None:
+        """Drop the cached recommendations of the user with the given item and of all their matches."""
+        self._recommendations.pop(item, None)
+        for neighbour in self._vertices[item].neighbours:
+            self._recommendations.pop(neighbour, None)
+
+    def get_repeaters(self, order: tuple[str, str]) -> set:
+        """Return the set of items of the users that have repeated the given (restaurant, cuisine) order.
+        """
+        return set(self._repeat_index.get(order, set()))
+
+    @instrumented('graph.match_all')
+    def match_all(self) -> None:
+        """Add an edge between every pair of users that share a repeated order.
+
+        Each edge carries the cuisines of all the repeated orders the two users share. Pairs are found through the
+        repeated order index, so only users that actually share an order are ever compared.
+        """
+        done = set()
+        for item, vertex in self._vertices.items():
+            for order in vertex.repeated_orders:
+                for other in self._repeat_index.get(order, ()):
+                    if other != item and other not in done:
+                        self.add_edge(item, other, order[1])
+            done.add(item)
+
+    @instrumented('graph.add_edge')
     def add_edge(self, item1: Any, item2: Any, matched_cuisine: str) -> None:
-        """Add an edge between the two vertices with the given items in this graph.
+        """Add an edge between the two vertices with the given items in this graph, matched on the given cuisine.
+
+        If the vertices are already adjacent, matched_cuisine is added to the cuisines their edge carries.
 
         Raise a ValueError if item1 or item2 do not appear as vertices in this graph.
 
@@ -93,25 +392,42 @@ class Graph:
             - item1 != item2
         """
         if item1 in self._vertices and item2 in self._vertices:
-            v1 = self._vertices[item1]
-            v2 = self._vertices[item2]
-
-            v1.neighbours[v2] = matched_cuisine
-            v2.neighbours[v1] = matched_cuisine
+            self._link(item1, item2, matched_cuisine)
+            self._dirty.update((item1, item2))
         else:
             raise ValueError
 
+    def _link(self, item1: Any, item2: Any, matched_cuisine: str) -> None:
+        """Add matched_cuisine to the edge between the two vertices with the given items, creating it if necessary.
+
+        Unlike add_edge, the two users are not marked as changed.
+
+        Preconditions:
+            - item1 != item2
+            - item1 in self._vertices and item2 in self._vertices
+        """
+        v1 = self._vertices[item1]
+        v2 = self._vertices[item2]
+
+        self._recommendations.pop(item1, None)
+        self._recommendations.pop(item2, None)
+        cuisines = v1.neighbours.get(item2, ())
+        if matched_cuisine not in cuisines:
+            cuisines += (matched_cuisine,)
+        v1.neighbours[item2] = cuisines
+        v2.neighbours[item1] = cuisines
+
     def adjacent(self, item1: Any, item2: Any) -> bool:
         """Return whether item1 and item2 are adjacent vertices in this graph.
 
         Return False if item1 or item2 do not appear as vertices in this graph.
         """
         if item1 in self._vertices and item2 in self._vertices:
-            v1 = self._vertices[item1]
-            return any(v2.item == item2 for v2 in v1.neighbours)
+            return item2 in self._vertices[item1].neighbours
         else:
             return False
 
+    @instrumented('graph.remove_edge')
     def remove_edge(self, item1: Any, item2: Any) -> None:
         """Remove an edge between the two vertices with the given items in this graph.
 
@@ -125,8 +441,11 @@ class Graph:
             v1 = self._vertices[item1]
             v2 = self._vertices[item2]
 
-            v1.neighbours.remove(v2)
-            v2.neighbours.remove(v1)
+            self._recommendations.pop(item1, None)
+            self._recommendations.pop(item2, None)
+            self._dirty.update((item1, item2))
+            v1.neighbours.pop(item2, None)
+            v2.neighbours.pop(item1, None)
         else:
             raise ValueError
 
@@ -139,7 +458,7 @@ class Graph:
         """
         if item in self._vertices:
             v = self._vertices[item]
-            return {neighbour.item for neighbour in v.neighbours}
+            return set(v.neighbours)
         else:
             raise ValueError
 
@@ -148,61 +467,749 @@ class Graph:
         """
         return set(self._vertices.keys())
 
+    def take_dirty(self) -> set:
+        """Return the items of the users that were added or changed since this method was last called.
+        """
+        dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def user_record(self, item: Any) -> tuple[list, list, list]:
+        """Return a JSON-compatible record of the user with the given item, which restore_user can read back.
+
+        The record is a tuple of the user's one time orders and repeated orders, each as a list of
+        [restaurant, cuisine, rating] lists, and their matches, as a list of [item, cuisines] lists.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        if item in self._vertices:
+            vertex = self._vertices[item]
+            return ([[restaurant, cuisine, rating] for (restaurant, cuisine), rating in vertex.one_time_orders.items()],
+                    [[restaurant, cuisine, rating] for (restaurant, cuisine), rating in vertex.repeated_orders.items()],
+                    [[other, list(cuisines)] for other, cuisines in vertex.neighbours.items()])
+        else:
+            raise ValueError
+
+    @instrumented('graph.restore_user')
+    def restore_user(self, item: Any, one_time_orders: list, repeated_orders: list, matches: list) -> None:
+        """Add the user with the given item to this graph from a record made by user_record, replacing their orders.
+
+        Matches with users that are not in this graph are skipped. Restoring a user does not mark them as changed.
+        """
+        self.add_vertex(item)
+        self._dirty.discard(item)
+        vertex = self._vertices[item]
+        for order in vertex.repeated_orders:
+            self._unindex_repeat(item, order)
+        vertex.one_time_orders = {self.intern_order(restaurant, cuisine): rating
+                                  for restaurant, cuisine, rating in one_time_orders}
+        vertex.repeated_orders = {self.intern_order(restaurant, cuisine): rating
+                                  for restaurant, cuisine, rating in repeated_orders}
+        self.index_repeated_orders(item)
+        for other, cuisines in matches:
+            if other in self._vertices and other != item:
+                for cuisine in cuisines:
+                    self._link(item, other, cuisine)
+
+    @instrumented('graph.save_to_json')
     def save_to_json(self, filename: str) -> None:
-        """Save the graph data to a JSON file."""
-        user_id = int(filename)
+        """Save the graph data to a JSON file named after the user's id."""
+        user_id = int(os.path.basename(filename))
         data2 = {
             str(user_id): [
                 {str(k): v for k, v in self._vertices[user_id].one_time_orders.items()},
                 {str(k): v for k, v in self._vertices[user_id].repeated_orders.items()},
-                [str(user.item) for user in self._vertices[user_id].neighbours]  # Convert items to str
+                {str(item): list(cuisines) for item, cuisines in self._vertices[user_id].neighbours.items()}
             ]
         }
         with open(filename, 'w') as file:
             json.dump(data2, file)
 
+    @instrumented('graph.load_from_json')
     def load_from_json(self, filename: str) -> None:
-        """Load graph data from a JSON file."""
-        user_id = int(filename)
-        with open(filename, 'r') as file:
-            data2 = json.load(file)
-            self.add_vertex(user_id)
-            self._vertices[user_id].one_time_orders = {
-                tuple(map(str, k)): v for k, v in data2[str(user_id)][0].items()
-            }
-            self._vertices[user_id].repeated_orders = {
-                tuple(map(str, k)): v for k, v in data2[str(user_id)][1].items()
-            }
-            for item in data2[str(user_id)][2]:
-                self.add_edge(user_id, int(item))
+        """Load graph data from a JSON file.
+
+        Files saved before edges carried their cuisines list only the ids of the matched users. For those, the user is
+        matched again on the repeated orders they share with each of those users that is in this graph.
+        """
+        user_id, one_time_orders, repeated_orders, matches = read_user_json(filename)
+        if isinstance(matches, dict):
+            matches = [[int(item), cuisines] for item, cuisines in matches.items()]
+        else:
+            shared = {(restaurant, cuisine) for restaurant, cuisine, _ in repeated_orders}
+            matches = [[int(item), [order[1] for order in self._vertices[int(item)].repeated_orders if order in shared]]
+                       for item in matches if int(item) in self._vertices]
+        self.restore_user(user_id, one_time_orders, repeated_orders, matches)
+
+    @instrumented('graph.match_users')
+    def match_users(self, items: Any) -> None:
+        """Match each of the users with the given items with every user they share a repeated order with.
+
+        Use this after restoring many users at once without their matches. Like restore_user, it does not mark anyone
+        as changed, since the matches can always be found again from the users' orders.
+        """
+        for item in items:
+            for order in self._vertices[item].repeated_orders:
+                for other in self._repeat_index.get(order, ()):
+                    if other != item:
+                        self._link(item, other, order[1])
+
+    def index_repeated_orders(self, item: Any) -> None:
+        """Add every repeated order of the user with the given item to the repeated order index.
+
+        Use this after filling a vertex's orders directly rather than through add_order.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        if item in self._vertices:
+            self._forget_recommendations(item)
+            for order in self._vertices[item].repeated_orders:
+                self._index_repeat(item, order)
+        else:
+            raise ValueError
+
+    @instrumented('graph.save_snapshot')
+    def save_snapshot(self, filename: str, menu: dict[str, set[str]], source: dict[str, Any]) -> None:
+        """Save this graph and the given menu to a binary snapshot file with the given filename.
+
+        Restaurants, cuisines and ratings are interned into tables, and orders, matches and the menu are stored as
+        flat integer arrays (one slice per user, like a CSR matrix) that load_snapshot can memory-map. The snapshot
+        is tagged with source, the source_tag of the CSV the graph was built from.
+
+        Preconditions:
+            - all(isinstance(item, int) for item in self._vertices)
+        """
+        users = list(self._vertices)
+        position = {item: i for i, item in enumerate(users)}
+        tables = {'restaurants': {}, 'cuisines': {}, 'ratings': {}}
+
+        def intern(table: str, value: Any) -> int:
+            """Return the id of value in the given table, adding it first if necessary."""
+            return tables[table].setdefault(value, len(tables[table]))
+
+        columns = {name: [] for name in ['one_time_ptr', 'one_time_restaurant', 'one_time_cuisine', 'one_time_rating',
+                                         'repeated_ptr', 'repeated_restaurant', 'repeated_cuisine', 'repeated_rating',
+                                         'neighbour_ptr', 'neighbour', 'neighbour_cuisine',
+                                         'menu_restaurant', 'menu_cuisine']}
+        for kind in ['one_time', 'repeated', 'neighbour']:
+            columns[kind + '_ptr'].append(0)
+        for item in users:
+            vertex = self._vertices[item]
+            for kind, orders in [('one_time', vertex.one_time_orders), ('repeated', vertex.repeated_orders)]:
+                for (restaurant, cuisine), rating in orders.items():
+                    columns[kind + '_restaurant'].append(intern('restaurants', restaurant))
+                    columns[kind + '_cuisine'].append(intern('cuisines', cuisine))
+                    columns[kind + '_rating'].append(intern('ratings', rating))
+                columns[kind + '_ptr'].append(len(columns[kind + '_restaurant']))
+            for neighbour, matched_cuisines in vertex.neighbours.items():
+                for matched_cuisine in matched_cuisines:
+                    columns['neighbour'].append(position[neighbour])
+                    columns['neighbour_cuisine'].append(intern('cuisines', matched_cuisine))
+            columns['neighbour_ptr'].append(len(columns['neighbour']))
+        for restaurant, cuisines in menu.items():
+            for cuisine in cuisines:
+                columns['menu_restaurant'].append(intern('restaurants', restaurant))
+                columns['menu_cuisine'].append(intern('cuisines', cuisine))
+
+        arrays = {'users': np.array(users, dtype=np.int64)}
+        for name, values in columns.items():
+            arrays[name] = np.array(values, dtype=np.int64 if name.endswith('_ptr') else np.int32)
+
+        descriptors = []
+        offset = 0
+        for name, array in arrays.items():
+            descriptors.append([name, array.dtype.str, len(array), offset])
+            offset += -(-array.nbytes // _SNAPSHOT_ALIGNMENT) * _SNAPSHOT_ALIGNMENT
+        header = json.dumps({'source': source,
+                             'tables': {table: list(values) for table, values in tables.items()},
+                             'arrays': descriptors}).encode()
+        start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // _SNAPSHOT_ALIGNMENT) * _SNAPSHOT_ALIGNMENT
+
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(SNAPSHOT_MAGIC)
+            file.write(len(header).to_bytes(8, 'little'))
+            file.write(header)
+            for (name, _, _, array_offset), array in zip(descriptors, arrays.values()):
+                file.seek(start + array_offset)
+                file.write(array.tobytes())
+        os.replace(filename + '.tmp', filename)
+
+    def load_snapshot_arrays(self, arrays: dict[str, np.ndarray], tables: dict[str, list]) -> None:
+        """Add the users in the arrays and tables of a snapshot saved by save_snapshot to this empty graph.
+
+        The arrays are worked on as they are (they can be memory-mapped), and every user's orders and matches are
+        made with one dict call from their slice of them, so nothing loops over single orders or matches in Python.
+
+        Preconditions:
+            - self._vertices == {}
+        """
+        restaurants, cuisines, ratings = tables['restaurants'], tables['cuisines'], tables['ratings']
+        users = arrays['users'].tolist()
+        rating_table = _object_array(ratings)
+
+        kinds = {}
+        orders = {}
+        for kind in ['one_time', 'repeated']:
+            # Each distinct order is interned once, and every row picks its tuple from the table of them.
+            codes = arrays[kind + '_restaurant'].astype(np.int64) * len(cuisines) + arrays[kind + '_cuisine']
+            distinct, order_of = np.unique(codes, return_inverse=True)
+            order_table = _object_array([self.intern_order(restaurants[code // len(cuisines)],
+                                                           cuisines[code % len(cuisines)])
+                                         for code in distinct.tolist()])
+            kinds[kind] = (order_table, order_of)
+            orders[kind] = _slices(order_table[order_of].tolist(), rating_table[arrays[kind + '_rating']].tolist(),
+                                   arrays[kind + '_ptr'].tolist())
+
+        order_table, order_of = kinds['repeated']
+        if len(order_of):
+            repeater = np.repeat(np.array(users, dtype=object), np.diff(arrays['repeated_ptr']))
+            by_order = np.argsort(order_of, kind='stable')
+            bounds = np.concatenate(([0], np.cumsum(np.bincount(order_of, minlength=len(order_table))))).tolist()
+            self._repeat_index = dict(zip(order_table.tolist(),
+                                          map(set, (repeater[by_order][start:stop]
+                                                    for start, stop in zip(bounds, bounds[1:])))))
+            counts = np.bincount(arrays['repeated_restaurant'], minlength=len(restaurants)).tolist()
+            self._restaurant_repeats = {restaurant: count for restaurant, count in zip(restaurants, counts) if count}
+            self._active = None
+
+        # A match on several cuisines is saved as consecutive rows with the same neighbour, so each run of such rows
+        # is one match. Most matches are on one cuisine, and those share one tuple per cuisine.
+        neighbour, cuisine, pointers = arrays['neighbour'], arrays['neighbour_cuisine'], arrays['neighbour_ptr']
+        matches = [{} for _ in users]
+        if len(neighbour):
+            owner = np.repeat(np.arange(len(users)), np.diff(pointers))
+            run_start = np.flatnonzero(np.concatenate(([True], (neighbour[1:] != neighbour[:-1])
+                                                       | (owner[1:] != owner[:-1]))))
+            run_length = np.diff(np.append(run_start, len(neighbour)))
+            labels = _object_array([(value,) for value in cuisines])[cuisine[run_start]]
+            for run in np.flatnonzero(run_length > 1).tolist():
+                first = int(run_start[run])
+                labels[run] = tuple(cuisines[value] for value in cuisine[first:first + run_length[run]].tolist())
+            matches = _slices(np.array(users, dtype=object)[neighbour[run_start]].tolist(), labels.tolist(),
+                              np.searchsorted(run_start, pointers).tolist())
+        self._vertices = dict(zip(users, map(_Vertex, users, orders['one_time'], orders['repeated'], matches)))
 
     @property
     def vertices(self):
         return self._vertices
 
 
-data = pd.read_csv("food_order.csv")
-data = data.filter(items=['customer_id', 'restaurant_name', 'cuisine_type', 'rating'])
-
-g = Graph()
-menu = {}
-for index, row in data.iterrows():
-    if row['customer_id'] not in g.get_all_vertices():
-        g.add_vertex(row['customer_id'])
-        vertex = g.vertices[row['customer_id']]
-        vertex.add_order(row['restaurant_name'], row['cuisine_type'], row['rating'])
-    else:
-        g.vertices[row['customer_id']].add_order(row['restaurant_name'], row['cuisine_type'], row['rating'])
-
-    if row['restaurant_name'] not in menu:
-        menu[row['restaurant_name']] = {row['cuisine_type']}
-    else:
-        menu[row['restaurant_name']].add(row['cuisine_type'])
-
-for x in g.vertices:
-    for y in g.vertices:
-        if not g.adjacent(x, y):
-            for a in g.vertices[x].repeated_orders:
-                for b in g.vertices[y].repeated_orders:
-                    if a == b:
-                        g.add_edge(x, y, a[1])
\ No newline at end of file
+def classify_orders(orders: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Split the given order rows into one time orders and repeated orders.
+
+    Return the rows of the orders each customer placed only once, and, for each order a customer placed more than
+    once, the row of its second placement (whose rating add_order keeps). Both keep the rows' original index.
+
+    Preconditions:
+        - {'customer_id', 'restaurant_name', 'cuisine_type', 'rating'}.issubset(orders.columns)
+        - orders.index.is_unique
+    """
+    groups = orders.groupby(['customer_id', 'restaurant_name', 'cuisine_type'], sort=False, dropna=False)
+    placed = groups.cumcount()
+    times_placed = groups['customer_id'].transform('size')
+    return orders[times_placed == 1], orders[(times_placed > 1) & (placed == 1)]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _parse_order_key(key: str) -> tuple[str, str]:
+    """Return the (restaurant, cuisine) order written as the given key by save_to_json."""
+    return ast.literal_eval(key)
+
+
+def read_user_json(filename: str) -> tuple[int, list, list, Union[list, dict]]:
+    """Read the user saved by Graph.save_to_json to the given file, without adding them to any graph.
+
+    Return their item, their one time and repeated orders as lists of [restaurant, cuisine, rating] lists, and their
+    matches as saved: a dict mapping each match's id to the cuisines of their edge, or, in files saved before edges
+    carried their cuisines, a list of the ids of the matched users.
+
+    Raise a FileNotFoundError if the file does not exist.
+    """
+    user_id = int(os.path.basename(filename))
+    with open(filename, 'r') as file:
+        data2 = json.load(file)
+    one_time_orders, repeated_orders, matches = data2[str(user_id)]
+    return (user_id,
+            [[*_parse_order_key(k), v] for k, v in one_time_orders.items()],
+            [[*_parse_order_key(k), v] for k, v in repeated_orders.items()],
+            matches)
+
+
+def _numeric_rating(rating: Any) -> Optional[float]:
+    """Return the given rating as a number, or None if the order was not rated (e.g. 'Not given' or 'N/A').
+    """
+    try:
+        rating = float(rating)
+    except (TypeError, ValueError):
+        return None
+    return None if rating != rating else rating
+
+
+def build_menu(orders: pd.DataFrame) -> dict[str, set[str]]:
+    """Return a mapping of each restaurant in the given orders to the set of cuisines it has been ordered for.
+
+    Preconditions:
+        - {'restaurant_name', 'cuisine_type'}.issubset(orders.columns)
+    """
+    cuisines = orders.groupby('restaurant_name', sort=False, dropna=False)['cuisine_type'].unique()
+    return {restaurant: set(options.tolist()) for restaurant, options in cuisines.items()}
+
+
+def source_tag(filename: str, with_hash: bool = True) -> dict[str, Any]:
+    """Return the size, modification time and (if with_hash) SHA-256 hash of the file with the given filename.
+
+    Snapshots are tagged with the source_tag of the CSV they were built from, so that a changed CSV can be detected.
+    """
+    stat = os.stat(filename)
+    tag = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        tag['sha256'] = digest.hexdigest()
+    return tag
+
+
+@instrumented('load_snapshot')
+def load_snapshot(filename: str, source: str) -> Optional[tuple[Graph, dict[str, set[str]]]]:
+    """Return the graph and menu saved by Graph.save_snapshot in the file with the given filename.
+
+    Return None if there is no such snapshot, or if it was not built from the current contents of the CSV with the
+    given source filename. The size and modification time of the CSV are checked first, and its hash is only
+    computed when they differ, so loading an up to date snapshot never reads the CSV.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                return None
+            header_length = int.from_bytes(file.read(8), 'little')
+            header = json.loads(file.read(header_length))
+    except (OSError, ValueError):
+        return None
+
+    tag = header['source']
+    current = source_tag(source, with_hash=False)
+    if current != {'size': tag['size'], 'mtime_ns': tag['mtime_ns']}:
+        if current['size'] != tag['size'] or source_tag(source)['sha256'] != tag['sha256']:
+            return None
+
+    start = -(-(len(SNAPSHOT_MAGIC) + 8 + header_length) // _SNAPSHOT_ALIGNMENT) * _SNAPSHOT_ALIGNMENT
+    arrays = {}
+    for name, dtype, length, offset in header['arrays']:
+        if length == 0:
+            arrays[name] = np.zeros(0, dtype=dtype)
+        else:
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=start + offset, shape=(length,))
+    restaurants = header['tables']['restaurants']
+    cuisines = header['tables']['cuisines']
+
+    graph = Graph()
+    graph.load_snapshot_arrays(arrays, header['tables'])
+    menu = {}
+    for restaurant, cuisine in zip(arrays['menu_restaurant'].tolist(), arrays['menu_cuisine'].tolist()):
+        menu.setdefault(restaurants[restaurant], set()).add(cuisines[cuisine])
+    return graph, menu
+
+
+def _object_array(values: list) -> np.ndarray:
+    """Return a one-dimensional array of the given Python objects, which NumPy indexing can pick from."""
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def _slices(keys: list, values: list, bounds: list[int]) -> list[dict]:
+    """Return the dicts made from keys[bounds[i]:bounds[i + 1]] and values[bounds[i]:bounds[i + 1]], for every i."""
+    return [dict(zip(keys[start:stop], values[start:stop])) for start, stop in zip(bounds, bounds[1:])]
+
+
+@instrumented('read_orders')
+def read_orders(filename: str) -> pd.DataFrame:
+    """Read the order history CSV with the given filename, keeping only the columns used to build the graph.
+
+    Ratings are read as strings even when every order was rated, so they have the same type as the ratings of orders
+    placed later.
+    """
+    orders = pd.read_csv(filename, dtype={'rating': str})
+    return orders.filter(items=['customer_id', 'restaurant_name', 'cuisine_type', 'rating'])
+
+
+class ReadWriteLock:
+    """A lock that many threads can hold at once to read, or one thread can hold alone to write.
+
+    Using the lock in a with statement holds it to write, like a threading.RLock; read returns a context manager that
+    holds it to read. Both are reentrant, and a thread holding the lock to write may also hold it to read. Threads
+    waiting to write go ahead of threads that have not started reading yet, so a steady stream of readers cannot keep
+    a writer waiting forever.
+    """
+    # Private Instance Attributes:
+    #     - _condition:
+    #         Held while the fields below are read or changed, and notified whenever the lock may have become free.
+    #     - _readers:
+    #         The number of threads holding the lock to read.
+    #     - _writer:
+    #         The identifier of the thread holding the lock to write, or None if no thread is.
+    #     - _writes:
+    #         The number of times the writer has acquired the lock without releasing it.
+    #     - _waiting_writers:
+    #         The number of threads waiting to hold the lock to write.
+    #     - _local:
+    #         Holds, for each thread, the number of times it has acquired the lock to read without releasing it.
+    _condition: threading.Condition
+    _readers: int
+    _writer: Optional[int]
+    _writes: int
+    _waiting_writers: int
+    _local: threading.local
+
+    def __init__(self) -> None:
+        """Initialize a lock that no thread holds."""
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    def acquire_read(self) -> None:
+        """Wait until no other thread holds the lock to write, then hold it to read."""
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writes += 1
+                return
+            reads = getattr(self._local, 'reads', 0)
+            if reads == 0:
+                while self._writer is not None or self._waiting_writers > 0:
+                    self._condition.wait()
+                self._readers += 1
+            self._local.reads = reads + 1
+
+    def release_read(self) -> None:
+        """Release the lock held to read by this thread.
+
+        Preconditions:
+            - this thread holds the lock
+        """
+        if self._writer == threading.get_ident():
+            self.release_write()
+            return
+        with self._condition:
+            self._local.reads -= 1
+            if self._local.reads == 0:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    def acquire_write(self) -> None:
+        """Wait until no other thread holds the lock, then hold it to write.
+
+        Raise a RuntimeError if this thread holds the lock to read but not to write, since it would wait forever.
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writes += 1
+                return
+            if getattr(self._local, 'reads', 0) > 0:
+                raise RuntimeError('cannot hold a lock to write while holding it to read')
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers > 0:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._writes = 1
+
+    def release_write(self) -> None:
+        """Release the lock held to write by this thread.
+
+        Preconditions:
+            - this thread holds the lock to write
+        """
+        with self._condition:
+            self._writes -= 1
+            if self._writes == 0:
+                self._writer = None
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def read(self) -> Iterator[None]:
+        """Hold the lock to read for the duration of a with statement."""
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    def __enter__(self) -> ReadWriteLock:
+        """Hold the lock to write for the duration of a with statement."""
+        self.acquire_write()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Release the lock held to write by the with statement."""
+        self.release_write()
+
+
+class GraphService:
+    """Owns the food delivery graph and menu, building them from the order history the first time they are needed.
+
+    Nothing is read when the service is created, so the program can start (and draw its first window) before the
+    graph exists. The graph can be built on demand, or in the background by calling start. If a snapshot of a graph
+    built from the same CSV has been saved, it is loaded instead of rebuilding the graph. The order statistics are
+    built from the CSV, since the snapshot does not hold them, with the orders placed since added back; start builds
+    them in the background after the graph, and otherwise they are built the first time they are needed.
+
+    Instance Attributes:
+        - filename: The name of the order history CSV the graph is built from
+        - snapshot: The name of the snapshot file the built graph is saved to, or None to never use a snapshot
+        - lock: The lock any thread must hold to write while it changes the built graph, or to read while it only
+        reads it. Graph methods that do not change the graph, such as recommend and active_restaurants, may be called
+        by many threads holding it to read at once.
+        - workers: The number of processes the graph is built from the CSV with
+        - max_neighbours: If not None, the graph is a similarity.SimilarGraph matching each user with at most this
+        many of the users most similar to them, instead of with everyone they share a repeated order with. Snapshots
+        are not used then, since they do not hold the similarity index.
+        - num_perm: The number of hash values in each MinHash signature of the similarity graph (see
+        similarity.MinHashIndex). More find similar users more reliably, but take longer.
+        - bands: The number of bands each signature is split into. More bands of fewer values make users less alike
+        candidates, raising recall at the cost of more candidates to compare.
+        - max_candidates: The most candidates the similarity graph compares each user with, or None for ten times
+        max_neighbours
+        - vectorized: Whether users are matched with sparse matrix products (see matrix.OrderMatrix), which needs
+        scipy, instead of with match_all. Only then are two-hop recommendations (see recommend_two_hop) given.
+        - placed_orders: If not None, returns the orders placed since the CSV was written, as OrderStats.add returned
+        them (for example GraphStore.orders), which are added to the order statistics when they are built
+
+    Representation Invariants:
+        - self.workers > 0
+        - self.max_neighbours is None or self.max_neighbours > 0
+        - self.num_perm > 0 and self.bands > 0 and self.num_perm % self.bands == 0
+        - self.max_candidates is None or self.max_candidates > 0
+    """
+    filename: str
+    snapshot: Optional[str]
+    lock: ReadWriteLock
+    workers: int
+    max_neighbours: Optional[int]
+    num_perm: int
+    bands: int
+    max_candidates: Optional[int]
+    vectorized: bool
+    placed_orders: Optional[Callable[[], Iterable[tuple]]]
+    # Private Instance Attributes:
+    #     - _graph:
+    #         The built graph, or None if it has not been built yet.
+    #     - _menu:
+    #         The built menu, mapping each restaurant to its cuisines, or None if it has not been built yet.
+    #     - _stats:
+    #         The statistics of the orders in the CSV and those placed since, or None if they have not been built yet.
+    #     - _lock:
+    #         Held while the graph is being built, so that it is only ever built once.
+    #     - _stats_lock:
+    #         Held while the order statistics are being built, so that they are only ever built once.
+    #     - _started:
+    #         Whether a background build has already been started.
+    #     - _matrix:
+    #         The matrix.OrderMatrix of the graph as it was built, matched, or None if it has not been made yet.
+    #     - _matrix_lock:
+    #         Held while _matrix is being made, so that it is only ever made once.
+    _graph: Optional[Graph]
+    _menu: Optional[dict[str, set[str]]]
+    _stats: Optional[OrderStats]
+    _lock: threading.Lock
+    _stats_lock: threading.Lock
+    _started: bool
+    _matrix: Optional[Any]
+    _matrix_lock: threading.Lock
+
+    def __init__(self, filename: str = 'food_order.csv', snapshot: Optional[str] = 'food_order.snapshot',
+                 workers: int = 1, max_neighbours: Optional[int] = None, vectorized: bool = False, num_perm: int = 64,
+                 bands: int = 16, max_candidates: Optional[int] = None) -> None:
+        """Initialize a service for the given order history. The graph is not built yet."""
+        self.filename = filename
+        self.snapshot = snapshot
+        self.lock = ReadWriteLock()
+        self.workers = workers
+        self.max_neighbours = max_neighbours
+        self.num_perm = num_perm
+        self.bands = bands
+        self.max_candidates = max_candidates
+        self.vectorized = vectorized
+        self.placed_orders = None
+        self._graph = None
+        self._menu = None
+        self._stats = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._started = False
+        self._matrix = None
+        self._matrix_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start building the graph, and then the order statistics, in a background thread, unless this has already
+        been started or the graph has already been built.
+        """
+        with self._lock:
+            if self._started or self._graph is not None:
+                return
+            self._started = True
+
+        def build_all() -> None:
+            """Build the graph, then the order statistics."""
+            self.build()
+            self.build_stats()
+
+        threading.Thread(target=build_all, daemon=True).start()
+
+    @instrumented('service.build')
+    def build(self) -> None:
+        """Build the graph and menu now, unless they have been built already.
+
+        If a background build is running, wait for it to finish instead. An up to date snapshot is loaded if there is
+        one; otherwise the graph is built from the CSV and a new snapshot is saved. Either way, no user starts out
+        marked as changed, since they can all be rebuilt from the CSV.
+        """
+        with self._lock:
+            if self._graph is not None:
+                return
+            use_snapshot = self.snapshot is not None and self.max_neighbours is None
+            loaded = load_snapshot(self.snapshot, self.filename) if use_snapshot else None
+            if loaded is not None:
+                graph, menu = loaded
+                graph.take_dirty()
+                graph.restaurant_index = RestaurantIndex(menu, graph.active_restaurants(), graph.restaurant_repeats())
+                self._graph, self._menu = graph, menu
+                return
+            tag = source_tag(self.filename)
+            orders = read_orders(self.filename)
+            # parallel, similarity and matrix are imported here, since they import this module.
+            if self.max_neighbours is not None:
+                from similarity import SimilarGraph
+                graph = SimilarGraph(self.max_neighbours, self.num_perm, self.bands, self.max_candidates)
+                graph.load_orders(orders)
+                graph.match_all()
+            elif self.vectorized:
+                from matrix import OrderMatrix
+                graph = Graph()
+                graph.load_orders(orders)
+                matrix = OrderMatrix.from_graph(graph)
+                matrix.match()
+                matrix.apply_matches(graph)
+                self._matrix = matrix
+            elif self.workers > 1:
+                from parallel import build_graph_parallel
+                graph = build_graph_parallel(orders, self.workers)
+            else:
+                graph = Graph()
+                graph.load_orders(orders)
+                graph.match_all()
+            graph.take_dirty()
+            menu = build_menu(orders)
+            graph.restaurant_index = RestaurantIndex(menu, graph.active_restaurants(), graph.restaurant_repeats())
+            if use_snapshot:
+                try:
+                    graph.save_snapshot(self.snapshot, menu, tag)
+                except OSError:
+                    pass
+            self._graph, self._menu = graph, menu
+
+    def is_built(self) -> bool:
+        """Return whether the graph and menu have been built."""
+        return self._graph is not None
+
+    @property
+    def graph(self) -> Graph:
+        """The food delivery graph, built first if necessary."""
+        if self._graph is None:
+            self.build()
+        return self._graph
+
+    @property
+    def menu(self) -> dict[str, set[str]]:
+        """The menu, mapping each restaurant to the cuisines it has been ordered for, built first if necessary."""
+        if self._menu is None:
+            self.build()
+        return self._menu
+
+    @property
+    def restaurant_index(self) -> RestaurantIndex:
+        """The search index of the restaurants on the menu, which the graph keeps up to date, built first if
+        necessary."""
+        return self.graph.restaurant_index
+
+    @instrumented('service.two_hop')
+    def recommend_two_hop(self, item: Any, k: Optional[int] = None) -> Optional[list]:
+        """Return the top k orders the matches of the matches of the user with the given item have tried, best first,
+        in the same form as Graph.recommend, or None if the service is not vectorized.
+
+        The matches are followed as they were when the graph was built (the matrix is made from the graph the first
+        time it is needed if the graph came from a snapshot), so a user added since gets none. Orders the user has
+        placed since, and orders Graph.recommend now gives them, are left out.
+
+        The caller must hold lock, to read or to write.
+
+        Preconditions:
+            - item in self.graph.vertices
+            - k is None or k >= 0
+        """
+        if not self.vectorized:
+            return None
+        with self._matrix_lock:
+            if self._matrix is None:
+                from matrix import OrderMatrix
+                matrix = OrderMatrix.from_graph(self.graph)
+                matrix.match()
+                self._matrix = matrix
+        if item not in self._matrix:
+            return []
+        vertex = self.graph.vertices[item]
+        one_hop = {order for order, _, _ in self.graph.recommend(item)}
+        recommendations = [recommendation for recommendation in self._matrix.recommend_two_hop(item)
+                           if recommendation[0] not in one_hop and recommendation[0] not in vertex.one_time_orders
+                           and recommendation[0] not in vertex.repeated_orders]
+        return recommendations if k is None else recommendations[:k]
+
+    @instrumented('service.build_stats')
+    def build_stats(self) -> None:
+        """Build the order statistics now, from the CSV and placed_orders, unless they have been built already.
+
+        If they are being built in another thread, wait for that to finish instead.
+        """
+        with self._stats_lock:
+            if self._stats is not None:
+                return
+            stats = OrderStats.from_csv(self.filename)
+            for order in (self.placed_orders() if self.placed_orders is not None else ()):
+                stats.add(*order)
+            self._stats = stats
+
+    @property
+    def stats_built(self) -> bool:
+        """Whether the order statistics have been built, so that reading stats will not build them."""
+        return self._stats is not None
+
+    @property
+    def stats(self) -> OrderStats:
+        """The statistics of the orders at each restaurant and of each cuisine, built first if necessary.
+
+        Orders placed through the service should be added to them with OrderStats.add while holding lock to write,
+        and the order it returns saved to wherever placed_orders reads from. It must be saved after it has been added,
+        so that statistics being built meanwhile cannot count it twice.
+        """
+        if self._stats is None:
+            self.build_stats()
+        return self._stats
+
+
+service = GraphService(workers=int(os.environ.get('SAVOURSYNC_BUILD_WORKERS', '1')),
+                       max_neighbours=(int(os.environ['SAVOURSYNC_MAX_NEIGHBOURS'])
+                                       if os.environ.get('SAVOURSYNC_MAX_NEIGHBOURS') else None),
+                       vectorized=os.environ.get('SAVOURSYNC_VECTORIZED', '') not in {'', '0'},
+                       num_perm=int(os.environ.get('SAVOURSYNC_NUM_PERM', '64')),
+                       bands=int(os.environ.get('SAVOURSYNC_BANDS', '16')),
+                       max_candidates=(int(os.environ['SAVOURSYNC_MAX_CANDIDATES'])
+                                       if os.environ.get('SAVOURSYNC_MAX_CANDIDATES') else None))
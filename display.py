@@ -11,12 +11,46 @@ This file is Copyright Abeera Fatima and Amal Nouman Irshad.
 from doctest import master
 from tkinter import *
 from data import *
-import random
-from typing import Any
+from store import GraphStore, new_userid, preload_users
+from stream import OrderStream
+from widgets import VirtualList
+from worker import TkWorker
+import os
+import threading
+from typing import Any, Optional
+
+store = GraphStore()
 
 root = Tk()
 root.title("SavourSync")
 
+worker = TkWorker(root, service.lock)
+
+# The orders the menu and recommendations can be shown in. Each maps to the statistic, segment and direction restaurants
+# are sorted by (see aggregate.OrderStats.ranked), or None to keep the usual order.
+SORT_ORDERS = {'Best match': None,
+               'Highest rated': ('rating', None, True),
+               'Fastest delivery': ('delivery_time', None, False),
+               'Cheapest': ('cost', None, False),
+               'Most ordered on weekdays': ('orders', 'weekday', True),
+               'Most ordered on weekends': ('orders', 'weekend', True)}
+
+
+def sort_restaurants(items: list, order: str, name: Any = None) -> list:
+    """ Returns the given items sorted in the given order from SORT_ORDERS. name returns the restaurant of an item, if
+    the items are not restaurants themselves.
+    """
+    if SORT_ORDERS[order] is None:
+        return items
+    statistic, segment, descending = SORT_ORDERS[order]
+    with service.lock.read():
+        # The statistics are built in the background by service.start, never here on the Tk thread, so until they are
+        # ready the items keep their usual order.
+        if not service.stats_built:
+            return items
+        return service.stats.ranked(items, statistic, segment=segment, descending=descending, name=name)
+
+
 root.geometry("1100x400")
 
 large_font = ('Helvetica', 24, 'bold')
@@ -25,19 +59,47 @@ label_large = Label(root, text="SavourSync", font=large_font)
 
 def title_page():
     label_large.pack(pady=20)
+    service.placed_orders = store.orders
+    service.start()
+
+    def preload() -> None:
+        """ Loads every saved user into the graph, then starts following the order log, if there is one. The stream
+        only starts once the preload is done, so restoring a saved user never undoes an order the stream applied.
+        """
+        if os.environ.get('SAVOURSYNC_PRELOAD', '1') != '0':
+            preload_users(service.graph, store, lock=service.lock)
+        if os.environ.get('SAVOURSYNC_ORDER_LOG'):
+            OrderStream(os.environ['SAVOURSYNC_ORDER_LOG'], service, store).start()
+
+    # The preload only holds the lock while it restores or matches a batch of users, so it runs on a thread of its
+    # own instead of the worker, and users can log in while it runs. Its timings are recorded as metrics.
+    threading.Thread(target=preload, name='preload', daemon=True).start()
 
     def new() -> None:
         """ Handles the case where a new user is using the program
         """
         clear_screen()
-        userid = random.randint(1000, 999999)
-        while userid in g.vertices:
-            userid = random.randint(1000, 999999)
-        Label(root, text=f'Your userid is {userid}. You can use this to log in in the future and access your '
-                         f'saved matches.').pack()
-        user = g.add_vertex(userid)
-        g.save_to_json(str(userid))
-        Button(root, text='Return', command=lambda: home_page(userid), padx=50).pack()
+        Label(root, text='Creating your userid...').pack()
+
+        def create() -> int:
+            """ Adds a user with a new random userid, which no user in the graph or saved has, to the graph and
+            returns the userid. Runs on the worker.
+            """
+            g = service.graph
+            userid = new_userid(g, store)
+            g.add_vertex(userid)
+            store.save_dirty(g)
+            return userid
+
+        def created(userid: int) -> None:
+            """ Shows the new user their userid.
+            """
+            clear_screen()
+            Label(root, text=f'Your userid is {userid}. You can use this to log in in the future and access your '
+                             f'saved matches.').pack()
+            Button(root, text='Return', command=lambda: home_page(userid), padx=50).pack()
+
+        worker.submit(create, created, cancellable=False)
 
     def returning() -> None:
         """ Handles the case where a returning user is using the program
@@ -51,14 +113,29 @@ def title_page():
             """ Code to be executed once the user inputs their id.
             """
             userid = int(e.get())
-            try:
-                g.load_from_json(str(userid))
-            except FileNotFoundError:
-                Label(root, text='Userid not found in database. Please enter a valid userid.').pack()
 
-            g.load_from_json(str(userid))
+            def load() -> bool:
+                """ Loads the user's saved data into the graph and returns whether it was found. Runs on the worker.
+                """
+                g = service.graph
+                if store.load_user(g, userid):
+                    return True
+                try:
+                    g.load_from_json(str(userid))
+                except FileNotFoundError:
+                    return False
+                return True
+
+            def loaded(found: bool) -> None:
+                """ Code to be executed once the user's saved data has been looked up.
+                """
+                if found:
+                    home_page(userid)
+                else:
+                    Label(root, text='Userid not found in database. Please enter a valid userid.').pack()
 
-            home_page(userid)
+            # Loading changes the graph, so it always finishes, even if the user leaves this screen first.
+            worker.submit(load, loaded, cancellable=False)
 
         Button(root, text="Enter", command=got_id).pack()
         Button(root, text="Back", command=ron).pack()
@@ -74,11 +151,14 @@ def title_page():
     ron()
 
     root.mainloop()
+    worker.close()
+    store.close()
 
 
 def clear_screen() -> None:
-    """ Removes all widgets on the screen except for the logo.
+    """ Removes all widgets on the screen except for the logo, and abandons any work started for the previous screen.
     """
+    worker.cancel_all()
     for widget in root.winfo_children():
         if widget is not label_large:
             widget.pack_forget()
@@ -90,54 +170,70 @@ def click_explore(label: Any, orderbutton: Any, explorebutton: Any, userid: Any)
     orderbutton.pack_forget()
     explorebutton.pack_forget()
     label.pack_forget()
-    if g.vertices[userid].neighbours == {}:
-        Label(root, text='You have no matches yet. Once you order a certain item repeatedly, you will be matched with '
-                         'users who share food preferences with you and can explore what new orders they have been'
-                         ' trying!').pack()
+    computing = Label(root, text='Finding recommendations...')
+    computing.pack()
+    return_button = Button(root, text='Return', command=lambda: home_page(userid), padx=50)
+    return_button.pack()
+
+    def find() -> tuple[Optional[list], Optional[list]]:
+        """ Returns the recommendations for the user, or None if they have no matches, and their two-hop
+        recommendations, or None if there are none to show. Runs on the worker.
+        """
+        g = service.graph
+        if g.vertices[userid].neighbours == {}:
+            return None, None
+        return g.recommend(userid), service.recommend_two_hop(userid, 5)
 
-    else:
-        user2 = g.vertices[userid]  # user2 is the VERTEX item representing our current user
-        recs = {}  # {12345: [(restaurant, cuisine), rating], 4: (restaurant, cuisine, rating)}
-        # {2: [(mcdonalds, american), 4.5]}
-        # rate_so_far = 4
-        for match in user2.neighbours:
-            for order in match.one_time_orders:
-                if user2.neighbours[match] == order[1]:
-                    if order not in user2.one_time_orders and order not in user2.repeated_orders:
-                        value = True
-                        for x in list(recs.keys()):
-                            if order == recs[x][0]:
-                                value = False
-                                rate_so_far = int(recs[x][1])
-                                if x > 1000:
-                                    recs.pop(x)
-                                    recs[2] = [order, (rate_so_far + int(match.one_time_orders[order])) / 2]
-                                    break
-                                else:
-                                    recs.pop(x)
-                                    recs[x + 1] = [order, (rate_so_far + int(match.one_time_orders[order])) / 2]
-                                    break
-                        if value:
-                            recs[match.item] = [order, match.one_time_orders[order]]
-        if recs == {}:
-            Label(root, text='Your matches have not tried anything new lately').pack()
-        else:
-            for x in recs:
-                if x < 1000:
-                    if recs[x][1] == 'Not given':
-                        Label(root, text=f'{x} of your matches tried {recs[x][0][1]} food from {recs[x][0][0]}').pack()
+    def found(result: tuple[Optional[list], Optional[list]]) -> None:
+        """ Shows the recommendations once they have been found.
+        """
+        recs, two_hop = result
+        computing.pack_forget()
+        shown = []
+        # The two-hop recommendations go last, just above the return button, and everything else above them.
+        bottom = return_button
+        if two_hop:
+            bottom = Label(root, text='Matches of your matches have also been trying:')
+            bottom.pack(before=return_button)
+            for (restaurant, cuisine), matches, _ in two_hop:
+                Label(root, text=f'{cuisine} food from {restaurant}, tried by {len(matches)} of them'
+                      ).pack(before=return_button)
+
+        def show(order: str) -> None:
+            """ Shows the recommendations in the given order from SORT_ORDERS.
+            """
+            for label in shown:
+                label.destroy()
+            shown.clear()
+            for (restaurant, cuisine), matches, rating in sort_restaurants(recs, order, lambda rec: rec[0][0]):
+                if len(matches) > 1:
+                    if rating is None:
+                        text = f'{len(matches)} of your matches tried {cuisine} food from {restaurant}'
                     else:
-                        Label(root,
-                              text=f'{x} of your matches tried {recs[x][0][1]} food from {recs[x][0][0]} and on average'
-                                   f' rated it {recs[x][1]} out of 5.').pack()
+                        text = (f'{len(matches)} of your matches tried {cuisine} food from {restaurant} and on '
+                                f'average rated it {round(rating, 1):g} out of 5.')
                 else:
-                    if recs[x][1] == 'Not given':
-                        Label(root, text=f'User {x} tried {recs[x][0][1]} food from {recs[x][0][0]}').pack()
+                    if rating is None:
+                        text = f'User {matches[0]} tried {cuisine} food from {restaurant}'
                     else:
-                        Label(root,
-                              text=f'User {x} tried {recs[x][0][1]} food from {recs[x][0][0]} and rated it {recs[x][1]}'
-                                   f' out of 5.').pack()
-    Button(root, text='Return', command=lambda: home_page(userid), padx=50).pack()
+                        text = (f'User {matches[0]} tried {cuisine} food from {restaurant} and rated it '
+                                f'{round(rating, 1):g} out of 5.')
+                label = Label(root, text=text)
+                label.pack(before=bottom)
+                shown.append(label)
+
+        if recs is None:
+            Label(root, text='You have no matches yet. Once you order a certain item repeatedly, you will be matched '
+                             'with users who share food preferences with you and can explore what new orders they have '
+                             'been trying!').pack(before=bottom)
+        elif recs == []:
+            Label(root, text='Your matches have not tried anything new lately').pack(before=bottom)
+        else:
+            order = StringVar(root, value='Best match')
+            OptionMenu(root, order, *SORT_ORDERS, command=show).pack(before=bottom)
+            show(order.get())
+
+    worker.submit(find, found)
 
 
 def click_order(userid: Any) -> None:
@@ -152,46 +248,54 @@ def open_menu(userid: Any) -> None:
     to choose a restaurant.
     """
     clear_screen()
+    # The service keeps the index up to date as orders are placed, so the menu only searches it, under the read lock.
+    index = service.restaurant_index
+    menu = service.menu
     newWindow = Toplevel(master)
 
     newWindow.title("Menu")
 
-    scrollable_frame = Frame(newWindow)
-    scrollable_frame.pack(fill=BOTH, expand=YES)
-
-    scrollbar = Scrollbar(scrollable_frame, orient=VERTICAL)
-    scrollbar.pack(side=RIGHT, fill=Y)
-
-    canvas = Canvas(scrollable_frame, yscrollcommand=scrollbar.set)
-    canvas.pack(side=LEFT, fill=BOTH, expand=YES)
-    scrollbar.config(command=canvas.yview)
-
-    scrollable_content = Frame(canvas)
-    canvas.create_window((0, 0), window=scrollable_content, anchor=NW)
-
-    def update_scroll_region(event):
-        canvas.configure(scrollregion=canvas.bbox("all"))
-
-    scrollable_content.bind("<Configure>", update_scroll_region)
-
-    for x in menu:
-        if any({x in k for k in [key for dictionary in [y.repeated_orders for y in g.vertices.values()] for key in
-                                 dictionary.keys()]}):
-            label = Label(scrollable_content, text=x)
-            label.pack()
-
     l1 = Label(root, text='Choose your restaurant from the Menu')
     l1.pack()
+    Label(root, text='Type to search the menu by restaurant or cuisine, and click a restaurant to choose it.').pack()
     Label(root, text='Please make sure to close the menu window before you click enter.').pack()
     e = Entry(root, width=50)
     e.pack()
 
+    def chosen(restaurant: str) -> None:
+        """ Fills in the restaurant the user clicked on in the menu.
+        """
+        e.delete(0, END)
+        e.insert(0, restaurant)
+
+    order = StringVar(newWindow, value='Best match')
+    # Only the rows on screen are widgets, so the menu opens as quickly however many restaurants it has.
+    listing = VirtualList(newWindow, rows=20, on_select=chosen)
+
+    def typed(event: Any = None) -> None:
+        """ Shows the restaurants matching what the user has typed so far, best first, or in the chosen order.
+        """
+        if listing.winfo_exists():
+            query = e.get()
+            with service.lock.read():
+                found = ([restaurant for restaurant, _ in index.search(query, 100)] if query.strip()
+                         else list(index.restaurants))
+            listing.set_items(sort_restaurants(found, order.get()))
+
+    OptionMenu(newWindow, order, *SORT_ORDERS, command=lambda choice: typed()).pack()
+    listing.pack(fill=BOTH, expand=YES)
+    typed()
+
+    e.bind('<KeyRelease>', typed)
+
     def got_restaurant() -> None:
         """ Executes the path to be followed when a user enters a restaurant.
         """
         restaurant = e.get()
-        l2 = Label(root, text='Please choose a valid restaurant from the given options')
         if restaurant not in menu:
+            with service.lock.read():
+                restaurant = index.resolve(restaurant)
+        if restaurant is None:
             l2 = Label(root, text='Please choose a valid restaurant from the given options')
             l2.pack()
         else:
@@ -222,31 +326,33 @@ def open_menu(userid: Any) -> None:
                         elif int(rating) > 5 or int(rating) < 0:
                             Label(root, text='Your rating must be between 0 and 5 inclusive.').pack()
                         else:
-                            g.vertices[userid].add_order(restaurant, cuisine, rating)
-                            new_matches = []
-                            for vertex in g.vertices:
-                                if not g.adjacent(vertex, userid) and vertex != userid:
-                                    matched_cuisine_list = [(tuple(a)[1]) for a in g.vertices[vertex].repeated_orders
-                                                            for
-                                                            b in
-                                                            g.vertices[userid].repeated_orders if a == b]
-                                    if matched_cuisine_list:
-                                        matched_cuisine = matched_cuisine_list[0]
-                                        new_matches.append(vertex)
-                                        g.add_edge(vertex, userid, matched_cuisine)
-
-                            g.save_to_json(str(userid))
-
-                            if len(new_matches) == 0:
+                            clear_screen()
+                            Label(root, text='Finding your matches...').pack()
+
+                            def place_order() -> list:
+                                """ Records the order, saves the user and returns their new matches. Runs on the
+                                worker.
+                                """
+                                g = service.graph
+                                new_matches = g.record_order(userid, restaurant, cuisine, rating)
+                                order = service.stats.add(restaurant, cuisine, rating)
+                                store.save_dirty(g, orders=[order])
+                                return new_matches
+
+                            def placed(new_matches: list) -> None:
+                                """ Code to be executed once the order has been recorded.
+                                """
                                 clear_screen()
-                                home_page(userid)
-                            else:
-                                clear_screen()
-                                match_made(new_matches, restaurant, cuisine, userid)
+                                if len(new_matches) == 0:
+                                    home_page(userid)
+                                else:
+                                    match_made(new_matches, restaurant, cuisine, userid)
+
+                            worker.submit(place_order, placed, cancellable=False)
 
                     Button(root, text='Enter', command=got_rating).pack()
 
-                label.after(1000, get_rating)
+                root.after(1000, get_rating)
 
             Button(root, text=list(menu[restaurant])[0], command=got_cuisine).pack()
             Button(root, text="Back", command=lambda: open_menu(userid)).pack()
@@ -259,8 +365,8 @@ def open_menu(userid: Any) -> None:
 def home_page(userid: Any) -> None:
     """ Returns the display to the home page.
     """
-    g.save_to_json(str(userid))
     clear_screen()
+    worker.submit(lambda: store.save_dirty(service.graph), cancellable=False)
     label_small = Label(root, text="If you know what you would like to order, press order. If you want to explore new"
                                    " options and see what your matches have been trying out, press explore!", )
     label_small.pack(padx=20)
@@ -297,9 +403,17 @@ def match_made(new_matches: Any, restaurant: Any, cuisine: Any, userid: Any) ->
         screen.
         """
         clear_screen()
-        for x in new_matches:
-            g.remove_edge(userid, x)
-        g.vertices[userid].repeated_orders.pop((restaurant, cuisine))
+
+        def remove() -> None:
+            """ Removes the matches and the repeated order they were made on, and saves the user. Runs on the worker.
+            """
+            g = service.graph
+            for x in new_matches:
+                g.remove_edge(userid, x)
+            g.remove_repeated_order(userid, restaurant, cuisine)
+            store.save_dirty(g)
+
+        worker.submit(remove, cancellable=False)
         Label(root, text='This/these user(s) have been removed as matches. You will not receive recommendations '
                          'based on their orders').pack()
         Button(root, text='Return', command=lambda: home_page(userid), padx=50).pack()
@@ -325,4 +439,4 @@ if __name__ == '__main__':
         'disable': ['E1136'],
         'extra-imports': ['master', 'tkinter', 'project_2_data', 'random'],
         'max-nested-blocks': 8
-    })
\ No newline at end of file
+    })
\ No newline at end of file
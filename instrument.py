@@ -0,0 +1,277 @@
+""" PROJECT 2 INSTRUMENT
+
+This module records how often the hot paths of SavourSync run and how long they take. It is off unless switched on
+with environment variables, and when it is off the instrumented functions are left exactly as they were written.
+
+Environment variables:
+    - SAVOURSYNC_METRICS=1: record a call counter and a latency histogram for every instrumented function
+    - SAVOURSYNC_METRICS_INTERVAL=<seconds>: also write a report every this many seconds
+    - SAVOURSYNC_METRICS_FILE=<path>: append reports to this file as JSON lines instead of writing them to stderr
+    - SAVOURSYNC_PROFILE=cprofile or tracemalloc: profile the instrumented functions named in
+      SAVOURSYNC_PROFILE_TARGETS (a comma separated list; all of them if unset), writing the results to
+      SAVOURSYNC_PROFILE_OUTPUT (savoursync.prof or savoursync.tracemalloc.txt by default) when the program exits.
+      From Python 3.12, only one cProfile profiler can run at a time in a process, and it records every thread, so
+      while any thread is in a profiled call, every thread's work is profiled.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import atexit
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Optional, TextIO, TypeVar
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+ENABLED = os.environ.get('SAVOURSYNC_METRICS', '') not in {'', '0'}
+PROFILE = os.environ.get('SAVOURSYNC_PROFILE', '').lower()
+PROFILE_TARGETS = {target.strip() for target in os.environ.get('SAVOURSYNC_PROFILE_TARGETS', '').split(',')
+                   if target.strip()}
+PROFILE_OUTPUT = os.environ.get('SAVOURSYNC_PROFILE_OUTPUT',
+                                'savoursync.prof' if PROFILE == 'cprofile' else 'savoursync.tracemalloc.txt')
+# From Python 3.12 cProfile is built on sys.monitoring, which allows only one active profiler per process, so a single
+# profiler is shared by every thread instead of each thread having its own.
+SHARED_PROFILER = sys.version_info >= (3, 12)
+
+
+class Histogram:
+    """The number of calls to one function, and how long they took, in power-of-two microsecond buckets.
+
+    Instance Attributes:
+        - count: The number of calls recorded
+        - total: The total number of seconds the calls took
+        - maximum: The number of seconds the slowest call took
+        - buckets: Maps b to the number of calls that took less than 2 ** b microseconds, but at least 2 ** (b - 1)
+    """
+    __slots__ = ('count', 'total', 'maximum', 'buckets')
+    count: int
+    total: float
+    maximum: float
+    buckets: dict[int, int]
+
+    def __init__(self) -> None:
+        """Initialize a histogram with no calls recorded."""
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = {}
+
+    def record(self, seconds: float) -> None:
+        """Record a call that took the given number of seconds."""
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        bucket = int(seconds * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, p: float) -> float:
+        """Return an upper bound, in seconds, on the latency of the given percentile of calls.
+
+        Preconditions:
+            - 0 <= p <= 100
+            - self.count > 0
+        """
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= self.count * p / 100:
+                return min((2 ** bucket) / 1e6, self.maximum)
+        return self.maximum
+
+    def summary(self) -> dict[str, Any]:
+        """Return the recorded calls as a JSON-compatible dictionary."""
+        return {'count': self.count,
+                'total_s': self.total,
+                'mean_s': self.total / self.count if self.count else 0.0,
+                'p50_s': self.percentile(50) if self.count else 0.0,
+                'p99_s': self.percentile(99) if self.count else 0.0,
+                'max_s': self.maximum,
+                'buckets_us': {str(2 ** bucket): calls for bucket, calls in sorted(self.buckets.items())}}
+
+
+_lock = threading.Lock()
+_latencies: dict[str, Histogram] = {}
+_counters: dict[str, int] = {}
+_profiling = threading.local()
+_profiles: list[cProfile.Profile] = []
+# The number of profiled calls running in any thread, when the profiler is shared.
+_shared_calls = 0
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add amount to the counter with the given name.
+
+    This does nothing unless metrics are enabled; callers on hot paths should check ENABLED first.
+    """
+    if ENABLED:
+        _add(name, amount)
+
+
+def _add(name: str, amount: int) -> None:
+    """Add amount to the counter with the given name, whether or not metrics are enabled."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def record(name: str, seconds: float) -> None:
+    """Record a call to the function with the given name that took the given number of seconds."""
+    with _lock:
+        if name not in _latencies:
+            _latencies[name] = Histogram()
+        _latencies[name].record(seconds)
+
+
+def instrumented(name: str) -> Callable[[F], F]:
+    """Return a decorator that records the calls to a function under the given name.
+
+    If neither metrics nor profiling of this function are switched on, the function is returned unchanged, so
+    instrumenting it costs nothing.
+    """
+    profiled = PROFILE in {'cprofile', 'tracemalloc'} and (not PROFILE_TARGETS or name in PROFILE_TARGETS)
+
+    def decorate(function: F) -> F:
+        """Wrap function so that its calls are recorded."""
+        if not ENABLED and not profiled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            outermost = profiled and not getattr(_profiling, 'active', False)
+            if outermost:
+                _profiling.active = True
+                _start_profile()
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if outermost:
+                    _stop_profile(name)
+                    _profiling.active = False
+                if ENABLED:
+                    record(name, elapsed)
+
+        return wrapper
+
+    return decorate
+
+
+def _start_profile() -> None:
+    """Start profiling the current call in this thread."""
+    global _shared_calls
+    if PROFILE == 'cprofile' and SHARED_PROFILER:
+        with _lock:
+            if not _profiles:
+                _profiles.append(cProfile.Profile())
+            _shared_calls += 1
+            if _shared_calls == 1:
+                _profiles[0].enable()
+    elif PROFILE == 'cprofile':
+        profile = getattr(_profiling, 'profile', None)
+        if profile is None:
+            profile = _profiling.profile = cProfile.Profile()
+            with _lock:
+                _profiles.append(profile)
+        profile.enable()
+    else:
+        _profiling.traced = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+
+
+def _stop_profile(name: str) -> None:
+    """Stop profiling the current call in this thread, which was to the function with the given name."""
+    global _shared_calls
+    if PROFILE == 'cprofile' and SHARED_PROFILER:
+        with _lock:
+            _shared_calls -= 1
+            if _shared_calls == 0:
+                _profiles[0].disable()
+    elif PROFILE == 'cprofile':
+        _profiling.profile.disable()
+    else:
+        current, peak = tracemalloc.get_traced_memory()
+        _add(name + '.allocated_bytes', max(current - _profiling.traced, 0))
+        _add(name + '.peak_bytes', max(peak - _profiling.traced, 0))
+
+
+def snapshot() -> dict[str, Any]:
+    """Return every counter and latency histogram recorded so far, as a JSON-compatible dictionary."""
+    with _lock:
+        return {'time': time.time(),
+                'counters': dict(_counters),
+                'latencies': {name: histogram.summary() for name, histogram in _latencies.items()}}
+
+
+def reset() -> None:
+    """Forget every counter and latency histogram recorded so far."""
+    with _lock:
+        _counters.clear()
+        _latencies.clear()
+
+
+def report(file: Optional[TextIO] = None) -> None:
+    """Write a snapshot of the metrics to file as one line of JSON.
+
+    By default it is appended to SAVOURSYNC_METRICS_FILE if that is set, and written to stderr otherwise.
+    """
+    line = json.dumps(snapshot())
+    if file is not None:
+        print(line, file=file, flush=True)
+    elif os.environ.get('SAVOURSYNC_METRICS_FILE'):
+        with open(os.environ['SAVOURSYNC_METRICS_FILE'], 'a') as output:
+            print(line, file=output)
+    else:
+        print(line, file=sys.stderr, flush=True)
+
+
+def start_reporting(interval: float) -> threading.Thread:
+    """Start a background thread that calls report every interval seconds, and return it.
+
+    Preconditions:
+        - interval > 0
+    """
+    def run() -> None:
+        """Report forever."""
+        while True:
+            time.sleep(interval)
+            report()
+
+    thread = threading.Thread(target=run, name='metrics-reporter', daemon=True)
+    thread.start()
+    return thread
+
+
+def _write_profile() -> None:
+    """Write the profiling results to PROFILE_OUTPUT."""
+    if PROFILE == 'cprofile':
+        with _lock:
+            profiles = [profile for profile in _profiles if profile.getstats()]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(PROFILE_OUTPUT)
+    else:
+        with open(PROFILE_OUTPUT, 'w') as file:
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:50]:
+                print(statistic, file=file)
+
+
+if PROFILE == 'tracemalloc':
+    tracemalloc.start()
+if PROFILE in {'cprofile', 'tracemalloc'}:
+    atexit.register(_write_profile)
+if ENABLED and os.environ.get('SAVOURSYNC_METRICS_INTERVAL'):
+    start_reporting(float(os.environ['SAVOURSYNC_METRICS_INTERVAL']))
+if ENABLED and os.environ.get('SAVOURSYNC_METRICS_FILE'):
+    atexit.register(report)
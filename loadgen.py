@@ -0,0 +1,136 @@
+""" PROJECT 2 LOADGEN
+
+This module measures how many requests per second a running SavourSync server (see server.py) can answer. Each
+simulated client creates a user, then keeps ordering from the menu and exploring its recommendations over one
+connection until the time is up. Results are written as JSON.
+
+Run it against a server with, for example:
+
+    python loadgen.py --port 8080 --clients 50 --seconds 30 --explore-ratio 0.8
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any
+
+from instrument import Histogram
+
+
+class _Connection:
+    """A keep-alive HTTP connection to a SavourSync server.
+
+    Instance Attributes:
+        - reader: The stream responses are read from
+        - writer: The stream requests are written to
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Initialize a connection over the given streams."""
+        self.reader = reader
+        self.writer = writer
+
+    async def request(self, method: str, path: str, body: dict) -> tuple[int, dict]:
+        """Send a request with the given JSON body, and return the status and JSON body of the response."""
+        payload = json.dumps(body).encode()
+        self.writer.write(f'{method} {path} HTTP/1.1\r\nHost: savoursync\r\nContent-Type: application/json\r\n'
+                          f'Content-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in {b'\r\n', b'\n', b''}:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self) -> None:
+        """Close the connection."""
+        self.writer.close()
+
+
+async def _client(host: str, port: int, deadline: float, explore_ratio: float, rng: random.Random,
+                  latencies: dict[str, Histogram], errors: dict[str, int]) -> None:
+    """Act as one user of the server until deadline, recording the latency of every request by path."""
+    connection = _Connection(*await asyncio.open_connection(host, port))
+
+    async def call(path: str, body: dict) -> dict:
+        """Send one request and record how long it took."""
+        start = time.perf_counter()
+        status, response = await connection.request('GET' if path == '/menu' else 'POST', path, body)
+        latencies.setdefault(path, Histogram()).record(time.perf_counter() - start)
+        if status != 200:
+            errors[path] = errors.get(path, 0) + 1
+        return response
+
+    try:
+        userid = (await call('/new-user', {}))['userid']
+        menu = list((await call('/menu', {}))['menu'].items())
+        while time.perf_counter() < deadline:
+            if rng.random() < explore_ratio or not menu:
+                await call('/explore', {'userid': userid, 'k': 10})
+            else:
+                # Customers mostly reorder from a few favourite places, so orders are drawn with a strong skew towards
+                # the start of the menu, which makes repeated orders (and so matches) common.
+                restaurant, cuisines = menu[min(int(rng.paretovariate(1.2)) - 1, len(menu) - 1)]
+                await call('/order', {'userid': userid, 'restaurant': restaurant, 'cuisine': cuisines[0],
+                                      'rating': rng.randint(0, 5)})
+    finally:
+        connection.close()
+
+
+async def run(host: str = '127.0.0.1', port: int = 8080, clients: int = 50, seconds: float = 10.0,
+              explore_ratio: float = 0.8, seed: int = 0) -> dict[str, Any]:
+    """Load the server at host and port with the given number of concurrent clients for the given number of seconds,
+    and return the requests per second it answered along with latencies by path.
+
+    Preconditions:
+        - clients > 0
+        - seconds > 0
+        - 0 <= explore_ratio <= 1
+    """
+    latencies = {}
+    errors = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, start + seconds, explore_ratio, random.Random(seed + i), latencies,
+                                   errors) for i in range(clients)])
+    elapsed = time.perf_counter() - start
+    requests = sum(histogram.count for histogram in latencies.values())
+    return {'clients': clients,
+            'seconds': elapsed,
+            'explore_ratio': explore_ratio,
+            'requests': requests,
+            'requests_per_second': requests / elapsed,
+            'errors': errors,
+            'latencies': {path: histogram.summary() for path, histogram in sorted(latencies.items())}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the requests per second a SavourSync server answers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--clients', type=int, default=50, help='number of concurrent simulated users')
+    parser.add_argument('--seconds', type=float, default=10.0, help='how long to run for')
+    parser.add_argument('--explore-ratio', type=float, default=0.8, help='fraction of requests that are explores')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file to write the JSON results to (default: stdout)')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.host, args.port, args.clients, args.seconds, args.explore_ratio, args.seed))
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -1,4 +1,5 @@
 from data import *
 from display import *
 
-title_page()
\ No newline at end of file
+if __name__ == '__main__':
+    title_page()
@@ -0,0 +1,319 @@
+""" PROJECT 2 MATRIX
+
+This module holds the orders of a food delivery graph as sparse user by order matrices, so that matching users and
+finding their recommendations become sparse matrix products instead of loops over dicts. It also finds
+friends-of-matches (two-hop) recommendations, which would take far too long to find with loops.
+
+It needs scipy, which the rest of SavourSync does not, so it can only be used once scipy is installed.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+
+import numpy as np
+
+from data import Graph, _numeric_rating
+from instrument import instrumented
+
+try:
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
+
+
+class OrderMatrix:
+    """The orders of the users of a Graph, as sparse matrices with a row for each user and a column for each order.
+
+    The matrices are a copy of the graph made by from_graph: later changes to the graph are not seen until a new one
+    is made. Call match before anything that uses the users' matches.
+
+    Instance Attributes:
+        - items: The item of the user in each row
+        - orders: The (restaurant, cuisine) order in each column
+        - cuisines: The cuisine of each cuisine id
+        - order_cuisine: The cuisine id of the order in each column
+        - repeated: 1 where the user has repeated the order
+        - one_time: 1 where the user has placed the order once
+        - rated: 1 where the user has placed the order once and gave it a numeric rating
+        - ratings: The rating the user gave the order, where it is numeric and they placed it once
+
+    Representation Invariants:
+        - self.repeated.shape == self.one_time.shape == self.rated.shape == self.ratings.shape
+        - self.repeated.shape == (len(self.items), len(self.orders))
+        - len(self.order_cuisine) == len(self.orders)
+    """
+    items: list
+    orders: list[tuple[str, str]]
+    cuisines: list[str]
+    order_cuisine: np.ndarray
+    repeated: Any
+    one_time: Any
+    rated: Any
+    ratings: Any
+    # Private Instance Attributes:
+    #     - _row:
+    #         Maps the item of each user to their row.
+    #     - _column:
+    #         Maps each order to its column.
+    #     - _shared:
+    #         For each cuisine id, a user by user matrix that is True where the two users share a repeated order of
+    #         that cuisine, or None before match is called.
+    #     - _matched:
+    #         A user by user matrix that is True where the two users are matched, or None before match is called.
+    #     - _columns:
+    #         For each cuisine id, the columns of its orders.
+    #     - _blocks:
+    #         For each cuisine id, the columns of one_time, rated and ratings for its orders, so that recommendations
+    #         only multiply the columns they need instead of slicing them out of the whole matrices on every call.
+    #     - _triers:
+    #         one_time in CSC form, so the users that placed each order can be read straight from its column.
+    _row: dict[Any, int]
+    _column: dict[tuple[str, str], int]
+    _shared: Optional[list[Any]]
+    _matched: Optional[Any]
+    _columns: list[np.ndarray]
+    _blocks: list[tuple[Any, Any, Any]]
+    _triers: Any
+
+    def __init__(self, items: list, orders: list[tuple[str, str]], repeated: Any, one_time: Any, rated: Any,
+                 ratings: Any) -> None:
+        """Initialize a matrix from its parts. Use from_graph to make one from a Graph.
+
+        Raise an ImportError if scipy is not installed.
+        """
+        if sp is None:
+            raise ImportError('OrderMatrix needs scipy; install it with pip install scipy')
+        self.items = items
+        self.orders = orders
+        self._row = {item: i for i, item in enumerate(items)}
+        self._column = {order: i for i, order in enumerate(orders)}
+        cuisine_ids = {}
+        self.order_cuisine = np.array([cuisine_ids.setdefault(cuisine, len(cuisine_ids)) for _, cuisine in orders],
+                                      dtype=np.int64)
+        self.cuisines = list(cuisine_ids)
+        self._columns = [np.flatnonzero(self.order_cuisine == c) for c in range(len(self.cuisines))]
+        self.repeated = repeated
+        self.one_time = one_time
+        self.rated = rated
+        self.ratings = ratings
+        self._blocks = [(one_time[:, columns], rated[:, columns], ratings[:, columns]) for columns in self._columns]
+        self._triers = one_time.tocsc()
+        self._shared = None
+        self._matched = None
+
+    def __contains__(self, item: Any) -> bool:
+        """Return whether the user with the given item has a row in this matrix."""
+        return item in self._row
+
+    @classmethod
+    @instrumented('matrix.from_graph')
+    def from_graph(cls, graph: Graph) -> OrderMatrix:
+        """Return the orders of every user in graph as matrices. Rows are in the order of graph.vertices.
+
+        Raise an ImportError if scipy is not installed.
+        """
+        if sp is None:
+            raise ImportError('OrderMatrix needs scipy; install it with pip install scipy')
+        columns = {}
+        repeated_rows, repeated_columns = [], []
+        one_time_rows, one_time_columns, rated, ratings = [], [], [], []
+        for row, vertex in enumerate(graph.vertices.values()):
+            for order in vertex.repeated_orders:
+                repeated_rows.append(row)
+                repeated_columns.append(columns.setdefault(order, len(columns)))
+            for order, rating in vertex.one_time_orders.items():
+                one_time_rows.append(row)
+                one_time_columns.append(columns.setdefault(order, len(columns)))
+                rating = _numeric_rating(rating)
+                rated.append(0.0 if rating is None else 1.0)
+                ratings.append(0.0 if rating is None else rating)
+        shape = (len(graph.vertices), len(columns))
+
+        def matrix(values: Any, rows: list[int], cols: list[int]) -> Any:
+            """Return a CSR matrix with the given values at the given rows and columns, and zeros elsewhere."""
+            return sp.csr_matrix((values, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+                                 shape=shape)
+
+        one_time = matrix(np.ones(len(one_time_rows)), one_time_rows, one_time_columns)
+        rated = matrix(np.array(rated), one_time_rows, one_time_columns)
+        rated.eliminate_zeros()
+        return cls(list(graph.vertices), list(columns),
+                   matrix(np.ones(len(repeated_rows), dtype=np.int32), repeated_rows, repeated_columns),
+                   one_time, rated, matrix(np.array(ratings), one_time_rows, one_time_columns))
+
+    @instrumented('matrix.match')
+    def match(self) -> None:
+        """Find the matches of every user: two users are matched on a cuisine if they share a repeated order of it.
+
+        For each cuisine, the number of repeated orders of that cuisine each pair of users shares is the product of
+        the repeated matrix's columns for that cuisine with their transpose.
+        """
+        shared = []
+        matched = sp.csr_matrix((len(self.items), len(self.items)), dtype=bool)
+        for columns in self._columns:
+            repeated = self.repeated[:, columns]
+            together = (repeated @ repeated.T).tocsr()
+            together.setdiag(0)
+            together.eliminate_zeros()
+            together = together.astype(bool)
+            shared.append(together)
+            matched = matched + together
+        self._shared = shared
+        self._matched = matched.tocsr()
+
+    def matched_cuisines(self, item: Any) -> dict[Any, set[str]]:
+        """Return the matches of the user with the given item, mapped to the cuisines they are matched on.
+
+        Preconditions:
+            - match has been called
+            - item in self.items
+        """
+        row = self._row[item]
+        matches = {}
+        for cuisine, together in zip(self.cuisines, self._shared):
+            for other in together.indices[together.indptr[row]:together.indptr[row + 1]]:
+                matches.setdefault(self.items[other], set()).add(cuisine)
+        return matches
+
+    @instrumented('matrix.apply_matches')
+    def apply_matches(self, graph: Graph) -> None:
+        """Replace the matches of every user in graph with the matches found by match.
+
+        Each edge carries exactly the cuisines, in the same order, that Graph.match_all would give it.
+
+        Preconditions:
+            - match has been called
+            - graph is the graph this matrix was made from, unchanged since
+        """
+        vertices = list(graph.vertices.values())
+        # Each pair of matched users gets a code: the sum over the cuisines they share of base + (the cuisine's id + 1).
+        # A code below 2 * base means they share exactly one cuisine, which the code gives, so most edges can be
+        # filled in from a table without looking at the pair; only pairs sharing several cuisines are worked out one
+        # at a time.
+        base = len(self.cuisines) + 1
+        codes = sp.csr_matrix((len(self.items), len(self.items)), dtype=np.int64)
+        for c, together in enumerate(self._shared):
+            codes = codes + together.astype(np.int64) * (base + c + 1)
+        codes = codes.tocsr()
+        table = {base + c + 1: (cuisine,) for c, cuisine in enumerate(self.cuisines)}
+        items = [vertex.item for vertex in vertices]
+
+        indptr = codes.indptr.tolist()
+        indices = codes.indices
+        data = codes.data
+        for row, vertex in enumerate(vertices):
+            start, stop = indptr[row], indptr[row + 1]
+            vertex.neighbours = dict(zip(map(items.__getitem__, indices[start:stop].tolist()),
+                                         map(table.get, data[start:stop].tolist())))
+
+        shared = {}
+        rows = np.repeat(np.arange(len(vertices)), np.diff(codes.indptr))
+        several = np.flatnonzero((data >= 2 * base) & (rows < indices))
+        for first, second in zip(rows[several].tolist(), indices[several].tolist()):
+            repeated = vertices[second].repeated_orders
+            cuisines = tuple(dict.fromkeys(order[1] for order in vertices[first].repeated_orders if order in repeated))
+            cuisines = shared.setdefault(cuisines, cuisines)
+            vertices[first].neighbours[items[second]] = cuisines
+            vertices[second].neighbours[items[first]] = cuisines
+
+    def _tried(self, users: Any, cuisine: int, exclude: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return, for each column of the orders of the cuisine with the given id, how many of the given users placed
+        that order once, how many of them rated it, and the sum of their ratings. Orders the user in row exclude has
+        placed count as untried.
+        """
+        columns = self._columns[cuisine]
+        one_time, rated, ratings = self._blocks[cuisine]
+        counts = (users @ one_time).toarray().ravel()
+        rated = (users @ rated).toarray().ravel()
+        totals = (users @ ratings).toarray().ravel()
+        placed = set(self.one_time.indices[self.one_time.indptr[exclude]:self.one_time.indptr[exclude + 1]].tolist())
+        placed.update(self.repeated.indices[self.repeated.indptr[exclude]:self.repeated.indptr[exclude + 1]].tolist())
+        for i, column in enumerate(columns.tolist()):
+            if column in placed:
+                counts[i] = 0
+        return counts, rated, totals
+
+    def _ranked(self, found: dict[int, tuple[Any, int, float, float]],
+                k: Optional[int]) -> list[tuple[tuple[str, str], list, Optional[float]]]:
+        """Return the given recommendations, as Graph.recommend does, ranked by how many users tried each order and
+        then by its mean rating.
+
+        found maps each column to the vector of the users that tried it, how many did, how many rated it, and the
+        sum of their ratings.
+        """
+        ranked = sorted(found.items(), key=lambda pair: (pair[1][1], pair[1][3] / pair[1][2] if pair[1][2] else -1.0),
+                        reverse=True)
+        if k is not None:
+            ranked = ranked[:k]
+        triers_ptr, triers_of = self._triers.indptr, self._triers.indices
+        recommendations = []
+        for column, (users, _, rated, total) in ranked:
+            triers = triers_of[triers_ptr[column]:triers_ptr[column + 1]]
+            members = set(users.indices.tolist())
+            matches = [self.items[user] for user in triers.tolist() if user in members]
+            recommendations.append((self.orders[column], matches, total / rated if rated else None))
+        return recommendations
+
+    @instrumented('matrix.recommend')
+    def recommend(self, item: Any, k: Optional[int] = None) -> list[tuple[tuple[str, str], list, Optional[float]]]:
+        """Return the top k new orders the matches of the user with the given item have tried, best first.
+
+        The recommendations are the same as Graph.recommend gives for a graph with the same matches, though orders
+        that rank equally, and the matches that tried each order, may come in a different order.
+
+        Preconditions:
+            - match has been called
+            - item in self.items
+            - k is None or k >= 0
+        """
+        row = self._row[item]
+        found = {}
+        for cuisine, (together, columns) in enumerate(zip(self._shared, self._columns)):
+            if together.indptr[row] == together.indptr[row + 1] or len(columns) == 0:
+                continue
+            users = together[row]
+            counts, rated, totals = self._tried(users, cuisine, row)
+            for i in np.flatnonzero(counts).tolist():
+                found[int(columns[i])] = (users, int(counts[i]), float(rated[i]), float(totals[i]))
+        return self._ranked(found, k)
+
+    @instrumented('matrix.recommend_two_hop')
+    def recommend_two_hop(self, item: Any,
+                          k: Optional[int] = None) -> list[tuple[tuple[str, str], list, Optional[float]]]:
+        """Return the top k new orders the matches of the matches of the user with the given item have tried, best
+        first, in the same form as recommend.
+
+        Only users two steps away count: the user's own matches and the user are left out, as are the orders
+        recommend already gives. Only orders in the cuisines the user is matched on are recommended.
+
+        Preconditions:
+            - match has been called
+            - item in self.items
+            - k is None or k >= 0
+        """
+        row = self._row[item]
+        direct = self._matched[row]
+        if direct.nnz == 0:
+            return []
+        reached = (direct.astype(np.int64) @ self._matched).tolil()
+        for user in direct.indices.tolist() + [row]:
+            reached[0, user] = 0
+        users = reached.tocsr().astype(bool)
+        users.eliminate_zeros()
+        if users.nnz == 0:
+            return []
+        one_hop = {self._column[order] for order, _, _ in self.recommend(item)}
+        found = {}
+        for cuisine, (together, columns) in enumerate(zip(self._shared, self._columns)):
+            if together.indptr[row] == together.indptr[row + 1] or len(columns) == 0:
+                continue
+            counts, rated, totals = self._tried(users, cuisine, row)
+            for i in np.flatnonzero(counts).tolist():
+                if int(columns[i]) not in one_hop:
+                    found[int(columns[i])] = (users, int(counts[i]), float(rated[i]), float(totals[i]))
+        return self._ranked(found, k)
+
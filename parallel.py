@@ -0,0 +1,186 @@
+""" PROJECT 2 PARALLEL
+
+This module builds the food delivery graph from the order history on several processes at once. The result is the
+same graph that Graph.load_orders followed by Graph.match_all builds on one.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import bisect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from data import Graph, classify_orders
+from instrument import instrumented
+
+# The data every matching worker reads, set once per process by _start_matching.
+_repeated: list[list[int]] = []
+_repeaters: list[list[int]] = []
+_cuisine_of: list[int] = []
+
+
+def _context() -> multiprocessing.context.BaseContext:
+    """Return the context worker processes are started with.
+
+    The graph is built on a background thread of a program that may have Tk and other threads running, which a forked
+    child would inherit in whatever state they were in, so workers are started by a fork server, which has only this
+    module loaded, or spawned where there is no fork server.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def _start_matching(repeated_ptr: np.ndarray, repeated: np.ndarray, repeaters_ptr: np.ndarray, repeaters: np.ndarray,
+                    cuisine_of: np.ndarray) -> None:
+    """Initialize a matching worker with the repeated orders of every user, the repeaters of every order (in
+    increasing order), and the cuisine of every order.
+
+    The first two are given as compressed rows: the numbers of user i's repeated orders are repeated[repeated_ptr[i]:
+    repeated_ptr[i + 1]], and likewise for repeaters. Users are numbered by their position in the graph.
+    """
+    global _repeated, _repeaters, _cuisine_of
+    _repeated = _rows(repeated_ptr, repeated)
+    _repeaters = _rows(repeaters_ptr, repeaters)
+    _cuisine_of = cuisine_of.tolist()
+
+
+def _rows(pointers: np.ndarray, values: np.ndarray) -> list[list[int]]:
+    """Return the rows of the given compressed rows as lists."""
+    values = values.tolist()
+    bounds = pointers.tolist()
+    return [values[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def _match_users(start: int, stop: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[tuple[int, ...]]]:
+    """Return the matches of the users numbered start to stop - 1 with every user numbered after them.
+
+    Matches are returned as three arrays, of the users, the users they are matched with, and the labels of the
+    matches, and a list of the cuisine combinations labels refer to. A label of c >= 0 means the two users share only
+    cuisine c, and a label of -1 - i means they share the cuisines in combination i, in the order the first user
+    repeated them. Arrays are returned instead of lists of tuples since they are much quicker to send between
+    processes.
+    """
+    users, others, labels = [], [], []
+    combinations = {}
+    for user in range(start, stop):
+        found = {}
+        for order in _repeated[user]:
+            cuisine = _cuisine_of[order]
+            repeaters = _repeaters[order]
+            for other in repeaters[bisect.bisect_right(repeaters, user):]:
+                if other in found:
+                    if cuisine not in found[other]:
+                        found[other].append(cuisine)
+                else:
+                    found[other] = [cuisine]
+        for other, cuisines in found.items():
+            users.append(user)
+            others.append(other)
+            if len(cuisines) == 1:
+                labels.append(cuisines[0])
+            else:
+                labels.append(-1 - combinations.setdefault(tuple(cuisines), len(combinations)))
+    return (np.array(users, dtype=np.int32), np.array(others, dtype=np.int32), np.array(labels, dtype=np.int32),
+            list(combinations))
+
+
+@instrumented('parallel.build_graph')
+def build_graph_parallel(orders: pd.DataFrame, workers: Optional[int] = None) -> Graph:
+    """Return the graph of the given orders, with every match added, built using the given number of processes.
+
+    Orders are classified by shards of customers, so every order of one customer is classified by the same process.
+    The classified orders are then added to the graph in this process, and the matches of the users are found by
+    shards of users, each process comparing its users with every user after them. workers defaults to the number of
+    CPUs.
+
+    Preconditions:
+        - {'customer_id', 'restaurant_name', 'cuisine_type', 'rating'}.issubset(orders.columns)
+        - workers is None or workers > 0
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    orders = orders.reset_index(drop=True)
+    items = orders['customer_id'].unique().tolist()
+    graph = Graph()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_context()) as executor:
+        shard = pd.factorize(orders['customer_id'])[0] % workers
+        classified = list(executor.map(classify_orders, [orders[shard == i] for i in range(workers)]))
+    one_time = pd.concat([shard_one_time for shard_one_time, _ in classified]).sort_index()
+    repeated = pd.concat([shard_repeated for _, shard_repeated in classified]).sort_index()
+    graph.load_classified_orders(items, one_time, repeated)
+
+    _add_matches(graph, items, repeated, workers)
+    return graph
+
+
+def _add_matches(graph: Graph, items: list, repeated: pd.DataFrame, workers: int) -> None:
+    """Add an edge between every pair of users in graph that share a repeated order, using the given number of
+    processes.
+
+    items are the items of the users in graph, in the order they were added, and repeated the rows of their repeated
+    orders, in the order they were added to them.
+    """
+    # Users, orders and cuisines are numbered with NumPy, and the orders each user repeated and the users that
+    # repeated each order are put in compressed rows, so nothing here loops over orders in Python.
+    user = pd.Index(items).get_indexer(repeated['customer_id'])
+    restaurant_code, _ = pd.factorize(repeated['restaurant_name'])
+    cuisine_code, cuisines = pd.factorize(repeated['cuisine_type'])
+    _, first_row, order = np.unique(restaurant_code.astype(np.int64) * len(cuisines) + cuisine_code,
+                                    return_index=True, return_inverse=True)
+    by_user = np.argsort(user, kind='stable')
+    repeated_ptr = np.concatenate(([0], np.cumsum(np.bincount(user, minlength=len(items)))))
+    by_order = np.lexsort((user, order))
+    repeaters_ptr = np.concatenate(([0], np.cumsum(np.bincount(order, minlength=len(first_row)))))
+    cuisine_of = cuisine_code[first_row]
+
+    # Users with many repeated orders take longer to match, so the users are split into many more chunks than there
+    # are workers to keep every worker busy until the end.
+    chunk = max(1, len(items) // (workers * 16))
+    starts = range(0, len(items), chunk)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_context(), initializer=_start_matching,
+                             initargs=(repeated_ptr, order[by_user], repeaters_ptr, user[by_order],
+                                       cuisine_of)) as executor:
+        results = list(executor.map(_match_users, starts, [min(start + chunk, len(items)) for start in starts]))
+
+    # Every match gets one label tuple, shared by all the matches on the same cuisines: single cuisines first, then
+    # each combination in the order it was first found.
+    cuisines = cuisines.tolist()
+    shared = [(cuisine,) for cuisine in cuisines]
+    combination_label = {}
+    for _, _, labels, combinations in results:
+        local = np.array([combination_label.setdefault(combination, len(cuisines) + len(combination_label))
+                          for combination in combinations], dtype=np.int32)
+        if len(local):
+            labels[labels < 0] = local[-1 - labels[labels < 0]]
+    shared.extend(tuple(cuisines[i] for i in combination) for combination in combination_label)
+    label_table = np.empty(len(shared), dtype=object)
+    for i, label in enumerate(shared):
+        label_table[i] = label
+
+    # Each match is an edge both ways. The edges are grouped by the user they leave, and each user's neighbours are
+    # made in one call from their slice of the edges.
+    users = np.concatenate([result[0] for result in results] or [np.zeros(0, dtype=np.int32)])
+    others = np.concatenate([result[1] for result in results] or [np.zeros(0, dtype=np.int32)])
+    labels = np.concatenate([result[2] for result in results] or [np.zeros(0, dtype=np.int32)])
+    sources = np.concatenate((users, others))
+    edges = np.argsort(sources, kind='stable')
+    targets = np.array(items, dtype=object)[np.concatenate((others, users))[edges]].tolist()
+    edge_labels = label_table[np.concatenate((labels, labels))[edges]].tolist()
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(items))))).tolist()
+    vertices = graph.vertices
+    for i, item in enumerate(items):
+        start, stop = bounds[i], bounds[i + 1]
+        if start < stop:
+            vertices[item].neighbours = dict(zip(targets[start:stop], edge_labels[start:stop]))
@@ -0,0 +1,266 @@
+""" PROJECT 2 SEARCH
+
+This module finds restaurants by name or cuisine as the user types, so the menu can offer completions instead of
+listing every restaurant.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import bisect
+import heapq
+import re
+from typing import Any, Callable, Optional
+
+# How well a restaurant matches a query, best first.
+EXACT, NAME_PREFIX, WORD_PREFIX, CUISINE_PREFIX, FUZZY = range(5)
+
+
+def normalize(text: str) -> str:
+    """Return text in the form it is searched in: lower case, with runs of anything but letters and digits turned
+    into single spaces.
+
+    >>> normalize("  Joe's  Shanghai! ")
+    'joe s shanghai'
+    """
+    return ' '.join(re.findall(r'[^\W_]+', text.casefold()))
+
+
+def _within_one_edit(word: str, query: str) -> bool:
+    """Return whether some prefix of word can be turned into query by at most one insertion, deletion, substitution
+    or swap of neighbouring characters.
+
+    >>> _within_one_edit('shanghai', 'shnag')
+    True
+    >>> _within_one_edit('shanghai', 'sjx')
+    False
+    """
+    for length in (len(query) - 1, len(query), len(query) + 1):
+        prefix = word[:length]
+        if len(prefix) != length:
+            continue
+        if length == len(query):
+            different = [i for i in range(length) if prefix[i] != query[i]]
+            if len(different) <= 1 or (len(different) == 2 and different[1] == different[0] + 1
+                                       and prefix[different[0]] == query[different[1]]
+                                       and prefix[different[1]] == query[different[0]]):
+                return True
+        else:
+            shorter, longer = (prefix, query) if length < len(query) else (query, prefix)
+            i = 0
+            while i < len(shorter) and shorter[i] == longer[i]:
+                i += 1
+            if shorter[i:] == longer[i + 1:]:
+                return True
+    return False
+
+
+class RestaurantIndex:
+    """A search index of restaurant names and the cuisines they serve, kept as sorted arrays searched with bisect.
+
+    A query is matched against, in order of preference: a restaurant's whole name, the start of its name, the start
+    of any word in its name, and the start of any cuisine it serves. If those give fewer results than asked for,
+    names with a word that is within one typing mistake of the query are added. Within each of these, more popular
+    restaurants come first, then restaurants in alphabetical order.
+
+    Restaurants can be added, removed and have their popularity changed in O(log n) comparisons each (plus moving
+    list items along, which is fast), so the index can be kept up to date instead of being rebuilt.
+
+    Instance Attributes:
+        - menu: Maps restaurants to the cuisines they serve. A restaurant's cuisines are read when it is added.
+        - restaurants: The restaurants in the index, in alphabetical order
+        - popularity: Maps restaurants to how popular they are. Restaurants that are not keys have popularity 0.
+    """
+    menu: dict[str, set[str]]
+    restaurants: list[str]
+    popularity: dict[str, int]
+    # Private Instance Attributes:
+    #     - _names:
+    #         Sorted (normalized name, restaurant) pairs.
+    #     - _words:
+    #         Sorted (word, restaurant) pairs, for every word of every normalized name.
+    #     - _cuisines:
+    #         Sorted (normalized cuisine, restaurant) pairs, for every cuisine every restaurant serves.
+    #     - _by_popularity:
+    #         Sorted (-popularity, name, restaurant) triples for every restaurant, so the most popular come first,
+    #         then restaurants in alphabetical order.
+    #     - _keys:
+    #         Maps each restaurant in the index to the (name, words, cuisines) it was indexed under, so it can be
+    #         removed again.
+    _names: list[tuple[str, str]]
+    _words: list[tuple[str, str]]
+    _cuisines: list[tuple[str, str]]
+    _by_popularity: list[tuple[int, str, str]]
+    _keys: dict[str, tuple[str, list[str], list[str]]]
+
+    def __init__(self, menu: dict[str, set[str]], restaurants: Optional[list[str]] = None,
+                 popularity: Optional[dict[str, int]] = None) -> None:
+        """Initialize an index of the given restaurants (every restaurant in menu by default), whose cuisines are
+        given by menu.
+        """
+        if restaurants is None:
+            restaurants = list(menu)
+        self.menu = menu
+        self.restaurants = sorted(set(restaurants), key=str)
+        self.popularity = dict(popularity) if popularity is not None else {}
+        self._keys = {restaurant: self._keys_of(restaurant) for restaurant in self.restaurants}
+        self._names = sorted((name, restaurant) for restaurant, (name, _, _) in self._keys.items())
+        self._words = sorted((word, restaurant) for restaurant, (_, words, _) in self._keys.items() for word in words)
+        self._cuisines = sorted((cuisine, restaurant) for restaurant, (_, _, cuisines) in self._keys.items()
+                                for cuisine in cuisines)
+        self._by_popularity = sorted(self._popularity_key(restaurant) for restaurant in self.restaurants)
+
+    def __len__(self) -> int:
+        """Return the number of restaurants in the index."""
+        return len(self.restaurants)
+
+    def __contains__(self, restaurant: str) -> bool:
+        """Return whether the given restaurant is in the index."""
+        return restaurant in self._keys
+
+    def _keys_of(self, restaurant: str) -> tuple[str, list[str], list[str]]:
+        """Return the normalized name, distinct name words and normalized cuisines the given restaurant is indexed
+        under.
+        """
+        name = normalize(str(restaurant))
+        return (name, sorted(set(name.split())),
+                sorted({normalize(str(cuisine)) for cuisine in self.menu.get(restaurant, ())}))
+
+    def _popularity_key(self, restaurant: str) -> tuple[int, str, str]:
+        """Return the entry of the given restaurant in _by_popularity."""
+        return (-self.popularity.get(restaurant, 0), str(restaurant), restaurant)
+
+    def add(self, restaurant: str) -> None:
+        """Add the given restaurant to the index, under the cuisines menu says it serves, if it is not in it already.
+        """
+        if restaurant in self._keys:
+            return
+        name, words, cuisines = self._keys[restaurant] = self._keys_of(restaurant)
+        bisect.insort(self.restaurants, restaurant, key=str)
+        bisect.insort(self._names, (name, restaurant))
+        for word in words:
+            bisect.insort(self._words, (word, restaurant))
+        for cuisine in cuisines:
+            bisect.insort(self._cuisines, (cuisine, restaurant))
+        bisect.insort(self._by_popularity, self._popularity_key(restaurant))
+
+    def remove(self, restaurant: str) -> None:
+        """Remove the given restaurant from the index, if it is in it. Its popularity is forgotten."""
+        if restaurant not in self._keys:
+            return
+        name, words, cuisines = self._keys.pop(restaurant)
+        _discard(self.restaurants, restaurant, key=str)
+        _discard(self._names, (name, restaurant))
+        for word in words:
+            _discard(self._words, (word, restaurant))
+        for cuisine in cuisines:
+            _discard(self._cuisines, (cuisine, restaurant))
+        _discard(self._by_popularity, self._popularity_key(restaurant))
+        self.popularity.pop(restaurant, None)
+
+    def refresh(self, restaurant: str) -> None:
+        """Index the given restaurant again under the cuisines menu now says it serves, if it is in the index."""
+        if restaurant in self._keys:
+            popularity = self.popularity.get(restaurant)
+            self.remove(restaurant)
+            if popularity is not None:
+                self.popularity[restaurant] = popularity
+            self.add(restaurant)
+
+    def set_popularity(self, restaurant: str, popularity: int) -> None:
+        """Set how popular the given restaurant is, adding it to the index if it is not in it, or removing it if
+        popularity is 0 or less.
+        """
+        if popularity <= 0:
+            self.remove(restaurant)
+            return
+        if restaurant in self._keys:
+            _discard(self._by_popularity, self._popularity_key(restaurant))
+            self.popularity[restaurant] = popularity
+            bisect.insort(self._by_popularity, self._popularity_key(restaurant))
+        else:
+            self.popularity[restaurant] = popularity
+            self.add(restaurant)
+
+    @staticmethod
+    def _starting(pairs: list[tuple[str, str]], prefix: str) -> list[tuple[str, str]]:
+        """Return the pairs whose key starts with prefix."""
+        start = bisect.bisect_left(pairs, (prefix,))
+        stop = bisect.bisect_left(pairs, (prefix + '\U0010ffff',), start)
+        return pairs[start:stop]
+
+    def _prefixed(self, pairs: list[tuple[str, str]], prefix: str) -> list[str]:
+        """Return the restaurants of the pairs whose key starts with prefix."""
+        return [restaurant for _, restaurant in self._starting(pairs, prefix)]
+
+    def _named(self, query: str) -> list[str]:
+        """Return the restaurants whose normalized name is the given normalized query."""
+        start = bisect.bisect_left(self._names, (query,))
+        stop = bisect.bisect_left(self._names, (query + '\x00',), start)
+        return [restaurant for _, restaurant in self._names[start:stop]]
+
+    def resolve(self, text: str) -> Optional[str]:
+        """Return the restaurant whose name is text, ignoring case, spacing and punctuation, or None if there is no
+        such restaurant, or more than one.
+        """
+        matches = self._named(normalize(text))
+        return matches[0] if len(matches) == 1 else None
+
+    def search(self, text: str, limit: int = 10) -> list[tuple[str, int]]:
+        """Return up to limit (restaurant, how it matched) pairs for the restaurants matching text, best first.
+
+        An empty query matches every restaurant, most popular first. The cost depends on how many restaurants match
+        the query and on limit, not on how many restaurants there are, except when the query is mistyped.
+
+        Preconditions:
+            - limit >= 0
+        """
+        query = normalize(text)
+        if query == '':
+            return [(restaurant, NAME_PREFIX) for _, _, restaurant in self._by_popularity[:limit]]
+
+        tiers = [self._named(query),
+                 self._prefixed(self._names, query),
+                 self._prefixed(self._words, query),
+                 self._prefixed(self._cuisines, query)]
+        found = {}
+        for tier, restaurants in enumerate(tiers):
+            # Restaurants already found may come up again, so enough are taken to still fill the results.
+            for restaurant in self._ranked(restaurants, limit + len(found)):
+                found.setdefault(restaurant, tier)
+            if len(found) >= limit:
+                break
+        if len(found) < limit and len(query) >= 3:
+            # Mistyped queries almost always get the first letter right, so only words starting with it are checked.
+            fuzzy = [restaurant for word, restaurant in self._starting(self._words, query[0])
+                     if _within_one_edit(word, query)]
+            for restaurant in self._ranked(fuzzy, limit + len(found)):
+                found.setdefault(restaurant, FUZZY)
+        return list(found.items())[:limit]
+
+    def _ranked(self, restaurants: list[str], limit: Optional[int] = None) -> list[str]:
+        """Return the given restaurants without repeats, most popular first, then in alphabetical order.
+
+        If limit is given, only that many are returned, which is much faster than ranking them all when there are
+        many.
+        """
+        def key(restaurant: str) -> tuple[int, str]:
+            return (-self.popularity.get(restaurant, 0), str(restaurant))
+
+        unique = dict.fromkeys(restaurants)
+        if limit is None or limit >= len(unique):
+            return sorted(unique, key=key)
+        return heapq.nsmallest(limit, unique, key=key)
+
+
+def _discard(items: list, item: Any, key: Optional[Callable[[Any], Any]] = None) -> None:
+    """Remove item from the sorted list items, if it is in it.
+
+    Preconditions:
+        - items is sorted by key, or by the items themselves if key is None
+    """
+    i = bisect.bisect_left(items, item if key is None else key(item), key=key)
+    if i < len(items) and items[i] == item:
+        del items[i]
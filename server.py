@@ -0,0 +1,386 @@
+""" PROJECT 2 SERVER
+
+This module serves SavourSync over HTTP without a window, so many people can use the same graph at once. Every
+request and response body is a JSON object:
+
+    - POST /new-user {} -> {"userid": <userid>}
+    - POST /login {"userid": <userid>} -> {"found": <whether the user's saved data was found>}
+    - GET /menu -> {"menu": {<restaurant>: [<cuisine>, ...], ...}}, the restaurants users have placed repeated
+      orders at
+    - POST /order {"userid": ..., "restaurant": ..., "cuisine": ..., "rating": <0 to 5>} -> {"new_matches": [...]}
+    - POST /explore {"userid": ..., "k": <optional limit>} -> {"recommendations": [{"restaurant": ..., "cuisine": ...,
+      "matches": [...], "rating": <mean or null>}, ...], "two_hop": [...]}, or {"recommendations": null, "two_hop":
+      null} if the user has no matches. "two_hop" lists, in the same form, what the matches of the user's matches
+      have tried, or is null unless the graph is vectorized (SAVOURSYNC_VECTORIZED=1)
+    - POST /remove-match {"userid": ..., "restaurant": ..., "cuisine": ..., "matches": [...]} -> {}
+
+The menu and recommendations can be sorted by a statistic of each restaurant's orders (see aggregate.parse_statistic)
+by adding {"sort": <statistic>, "segment": <optional "weekday" or "weekend">, "descending": <optional, false by
+default>} to their request body, e.g. {"sort": "delivery_time"} for the fastest first.
+
+Errors are returned as {"error": <message>} with a 4xx status, or a 500 status if the server failed while handling
+the request. Run it with, for example:
+
+    python server.py --port 8080 --threads 8
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from data import GraphService, service
+import instrument
+from instrument import instrumented
+from store import GraphStore, new_userid, preload_users
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error'}
+
+logger = logging.getLogger(__name__)
+
+# The largest request body the server reads, in bytes.
+MAX_BODY = 1 << 20
+
+
+def _is_int(value: Any) -> bool:
+    """Return whether value is a JSON integer. Booleans are not, even though bool is a subclass of int."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class RequestError(Exception):
+    """Raised while handling a request that cannot be served, to send the client an error response.
+
+    Instance Attributes:
+        - status: The HTTP status code of the response
+        - message: A description of the error, sent to the client
+    """
+    status: int
+    message: str
+
+    def __init__(self, status: int, message: str) -> None:
+        """Initialize an error with the given status and message."""
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class SavourSyncServer:
+    """An HTTP/JSON server for the graph of a GraphService.
+
+    Connections are handled on an asyncio event loop, and the graph work of each request runs on a pool of threads,
+    so a slow request does not hold up the others. Requests that only read the graph (menu and explore) hold the
+    service's lock to read, so any number of them run at once; requests that change it hold the lock to write. Changed
+    users are saved to the store after every write.
+
+    Instance Attributes:
+        - service: The service whose graph is served
+        - store: The store users are saved to and loaded from
+        - threads: The number of threads graph work runs on
+        - preload: Whether every saved user is loaded into the graph before the server starts accepting connections
+
+    Representation Invariants:
+        - self.threads > 0
+    """
+    service: GraphService
+    store: GraphStore
+    threads: int
+    preload: bool
+    # Private Instance Attributes:
+    #     - _executor:
+    #         The threads graph work runs on.
+    #     - _routes:
+    #         Maps each (method, path) to the function handling it, which takes the request body and returns the
+    #         response body.
+    _executor: ThreadPoolExecutor
+    _routes: dict[tuple[str, str], Callable[[dict], dict]]
+
+    def __init__(self, graph_service: GraphService, store: GraphStore, threads: int = 8, preload: bool = True) -> None:
+        """Initialize a server for the given service's graph. Nothing is built or opened until it is started."""
+        self.service = graph_service
+        self.store = store
+        self.threads = threads
+        self.preload = preload
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='graph-server')
+        self._routes = {('POST', '/new-user'): self.new_user,
+                        ('POST', '/login'): self.login,
+                        ('GET', '/menu'): self.menu,
+                        ('POST', '/order'): self.order,
+                        ('POST', '/explore'): self.explore,
+                        ('POST', '/remove-match'): self.remove_match}
+
+    def _user(self, body: dict) -> int:
+        """Return the userid in the given request body.
+
+        Raise a RequestError if it is missing, not an integer, or not a user in the graph.
+
+        Preconditions:
+            - the current thread holds self.service.lock
+        """
+        userid = body.get('userid')
+        if not _is_int(userid):
+            raise RequestError(400, 'userid must be an integer')
+        if userid not in self.service.graph.vertices:
+            raise RequestError(404, f'user {userid} is not logged in')
+        return userid
+
+    @staticmethod
+    def _order(body: dict) -> tuple[str, str]:
+        """Return the restaurant and cuisine in the given request body.
+
+        Raise a RequestError if either is missing or not a string.
+        """
+        restaurant, cuisine = body.get('restaurant'), body.get('cuisine')
+        if not isinstance(restaurant, str) or not isinstance(cuisine, str):
+            raise RequestError(400, 'restaurant and cuisine must be strings')
+        return restaurant, cuisine
+
+    def _sorted(self, items: list, body: dict, name: Optional[Callable[[Any], str]] = None) -> list:
+        """Return the given items sorted as the given request body asks, or unchanged if it does not ask for an order.
+        name returns the restaurant of an item, if the items are not restaurants themselves.
+
+        Raise a RequestError if the order asked for is not valid.
+
+        Preconditions:
+            - the current thread holds self.service.lock
+        """
+        statistic, descending = body.get('sort'), body.get('descending', False)
+        if statistic is None:
+            return items
+        if not isinstance(statistic, str):
+            raise RequestError(400, 'sort must be a string')
+        if not isinstance(descending, bool):
+            raise RequestError(400, 'descending must be true or false')
+        try:
+            return self.service.stats.ranked(items, statistic, segment=body.get('segment'), descending=descending,
+                                             name=name)
+        except ValueError as error:
+            raise RequestError(400, str(error))
+
+    @instrumented('server.new_user')
+    def new_user(self, body: dict) -> dict:
+        """Add a user with a new random userid, which no user in the graph or saved has, to the graph."""
+        with self.service.lock:
+            g = self.service.graph
+            userid = new_userid(g, self.store)
+            g.add_vertex(userid)
+            self.store.save_dirty(g)
+        return {'userid': userid}
+
+    @instrumented('server.login')
+    def login(self, body: dict) -> dict:
+        """Load the given user's saved data into the graph."""
+        userid = body.get('userid')
+        if not _is_int(userid):
+            raise RequestError(400, 'userid must be an integer')
+        with self.service.lock:
+            g = self.service.graph
+            if self.store.load_user(g, userid):
+                return {'found': True}
+            try:
+                g.load_from_json(str(userid))
+            except FileNotFoundError:
+                return {'found': False}
+            return {'found': True}
+
+    @instrumented('server.menu')
+    def menu(self, body: dict) -> dict:
+        """Return the restaurants users have placed repeated orders at, with the cuisines each serves."""
+        with self.service.lock.read():
+            restaurants = self._sorted(self.service.graph.active_restaurants(), body)
+            menu = self.service.menu
+            return {'menu': {restaurant: sorted(menu.get(restaurant, ())) for restaurant in restaurants}}
+
+    @instrumented('server.order')
+    def order(self, body: dict) -> dict:
+        """Record an order for the given user, and return the users they were newly matched with."""
+        restaurant, cuisine = self._order(body)
+        rating = body.get('rating')
+        if not _is_int(rating) or rating < 0 or rating > 5:
+            raise RequestError(400, 'rating must be an integer between 0 and 5 inclusive')
+        with self.service.lock:
+            userid = self._user(body)
+            if cuisine not in self.service.menu.get(restaurant, ()):
+                raise RequestError(400, f'{restaurant!r} does not serve {cuisine!r}')
+            g = self.service.graph
+            # Ratings are kept as strings, as they are for orders read from the CSV or placed in the window.
+            new_matches = g.record_order(userid, restaurant, cuisine, str(rating))
+            order = self.service.stats.add(restaurant, cuisine, str(rating))
+            self.store.save_dirty(g, orders=[order])
+        return {'new_matches': new_matches}
+
+    @instrumented('server.explore')
+    def explore(self, body: dict) -> dict:
+        """Return the recommendations for the given user, or None if they have no matches, and their two-hop
+        recommendations (see GraphService.recommend_two_hop).
+
+        If the request asks for an order, the first k of all the recommendations in that order are returned.
+        """
+        k = body.get('k')
+        if k is not None and (not _is_int(k) or k < 0):
+            raise RequestError(400, 'k must be a non-negative integer')
+        with self.service.lock.read():
+            userid = self._user(body)
+            g = self.service.graph
+            if g.vertices[userid].neighbours == {}:
+                return {'recommendations': None, 'two_hop': None}
+            if body.get('sort') is None:
+                recs = g.recommend(userid, k)
+                two_hop = self.service.recommend_two_hop(userid, k)
+            else:
+                recs = self._sorted(g.recommend(userid), body, lambda rec: rec[0][0])[:k]
+                two_hop = self.service.recommend_two_hop(userid)
+                if two_hop is not None:
+                    two_hop = self._sorted(two_hop, body, lambda rec: rec[0][0])[:k]
+
+        def as_json(recommendations: list) -> list[dict]:
+            """Return the given recommendations as JSON objects."""
+            return [{'restaurant': restaurant, 'cuisine': cuisine, 'matches': matches, 'rating': rating}
+                    for (restaurant, cuisine), matches, rating in recommendations]
+
+        return {'recommendations': as_json(recs), 'two_hop': None if two_hop is None else as_json(two_hop)}
+
+    @instrumented('server.remove_match')
+    def remove_match(self, body: dict) -> dict:
+        """Remove the given matches of the given user, and the repeated order they were made on."""
+        restaurant, cuisine = self._order(body)
+        matches = body.get('matches')
+        if not isinstance(matches, list) or not all(_is_int(x) for x in matches):
+            raise RequestError(400, 'matches must be a list of userids')
+        with self.service.lock:
+            userid = self._user(body)
+            g = self.service.graph
+            unknown = [x for x in matches if x not in g.vertices]
+            if unknown:
+                raise RequestError(400, f'{unknown[0]} is not a userid')
+            for x in matches:
+                if g.adjacent(userid, x):
+                    g.remove_edge(userid, x)
+            g.remove_repeated_order(userid, restaurant, cuisine)
+            self.store.save_dirty(g)
+        return {}
+
+    def _preload(self) -> dict:
+        """Load every saved user into the graph, and return what preload_users reports."""
+        return preload_users(self.service.graph, self.store, threads=self.threads, lock=self.service.lock)
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: dict, keep_alive: bool) -> None:
+        """Write a response with the given status and JSON body."""
+        payload = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status} {_REASONS.get(status, "Error")}\r\n'
+                     f'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(payload)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + payload)
+        await writer.drain()
+
+    async def _handle(self, method: str, path: str, payload: bytes) -> tuple[int, dict]:
+        """Return the status and body of the response to the given request."""
+        route = self._routes.get((method, path))
+        if route is None:
+            if any(route_path == path for _, route_path in self._routes):
+                return 405, {'error': f'{method} is not allowed on {path}'}
+            return 404, {'error': f'no such path {path}'}
+        try:
+            body = json.loads(payload) if payload else {}
+        except ValueError:
+            return 400, {'error': 'the request body is not valid JSON'}
+        if not isinstance(body, dict):
+            return 400, {'error': 'the request body must be a JSON object'}
+        try:
+            return 200, await asyncio.get_running_loop().run_in_executor(self._executor, route, body)
+        except RequestError as error:
+            return error.status, {'error': error.message}
+        except Exception:
+            # Anything else is a bug, so it is logged, and the client still gets an answer on an open connection.
+            logger.exception('error handling %s %s', method, path)
+            instrument.count('server.errors')
+            return 500, {'error': 'internal server error'}
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests sent on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'malformed request line'}, False)
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in {b'\r\n', b'\n', b''}:
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and (version == 'HTTP/1.1' or headers.get('connection', '').lower() == 'keep-alive'))
+                length = headers.get('content-length', '0') or '0'
+                if not length.isdigit():
+                    await self._respond(writer, 400, {'error': 'malformed Content-Length'}, False)
+                    return
+                length = int(length)
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': 'the request body is too large'}, False)
+                    return
+                payload = await reader.readexactly(length) if length > 0 else b''
+                status, body = await self._handle(method.upper(), target.split('?', 1)[0], payload)
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return
+        except ValueError:
+            # StreamReader.readline raises this when a line is longer than the stream's limit.
+            with contextlib.suppress(ConnectionError):
+                await self._respond(writer, 400, {'error': 'a request line or header is too long'}, False)
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080, ready: Optional[asyncio.Event] = None) -> None:
+        """Build the graph and the order statistics, then serve requests on the given host and port until cancelled.
+
+        ready is set once the server is accepting connections.
+        """
+        self.service.placed_orders = self.store.orders
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.service.build)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.service.build_stats)
+        if self.preload:
+            loaded = await asyncio.get_running_loop().run_in_executor(self._executor, self._preload)
+            logger.info('Loaded %d saved users in %.2f seconds', loaded['users'], loaded['total_s'])
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve SavourSync over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--threads', type=int, default=8, help='threads graph work runs on')
+    parser.add_argument('--database', default='savoursync.db', help='the SQLite database users are saved to')
+    parser.add_argument('--no-preload', action='store_true', help='only load saved users when they log in')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    try:
+        asyncio.run(SavourSyncServer(service, GraphStore(args.database), args.threads, not args.no_preload)
+                    .serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,344 @@
+""" PROJECT 2 SIMILARITY
+
+This module matches users approximately: instead of linking every pair of users that share a repeated order, each
+user is linked with at most a fixed number of the users whose repeated orders are most like theirs. Similar users are
+found with MinHash signatures and a locality-sensitive hashing (LSH) index, so finding them does not mean comparing a
+user with everyone who shares one of their orders.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from data import Graph
+from instrument import instrumented
+
+# The prime the MinHash hash functions work modulo.
+_PRIME = (1 << 31) - 1
+
+
+class MinHashIndex:
+    """An LSH index of the MinHash signatures of sets of orders, for finding the sets most like a given one.
+
+    Each signature holds num_perm minimum hash values, split into bands of num_perm // bands values. Two sets are
+    candidates for each other if all the values in any one band are equal. Sets with Jaccard similarity s become
+    candidates with probability 1 - (1 - s ** r) ** bands, where r = num_perm // bands, so more bands (of fewer values)
+    find more of the similar sets (higher recall) at the cost of more dissimilar candidates.
+
+    Instance Attributes:
+        - num_perm: The number of hash values in each signature
+        - bands: The number of bands each signature is split into
+        - max_candidates: The largest number of candidates query returns, which bounds its cost however many sets
+        share a bucket
+
+    Representation Invariants:
+        - self.num_perm % self.bands == 0
+        - self.max_candidates > 0
+    """
+    num_perm: int
+    bands: int
+    max_candidates: int
+    # Private Instance Attributes:
+    #     - _a, _b:
+    #         The coefficients of the hash functions. The ith maps x to (_a[i] * x + _b[i]) % _PRIME.
+    #     - _ids:
+    #         Maps each order that has been hashed to the number it is hashed as.
+    #     - _signatures:
+    #         Maps the key of each set in the index to its signature.
+    #     - _buckets:
+    #         For each band, maps the bytes of that band of a signature to the keys of the sets with that band, in
+    #         the order they were inserted. Values are dicts used as ordered sets.
+    _a: np.ndarray
+    _b: np.ndarray
+    _ids: dict[Any, int]
+    _signatures: dict[Any, np.ndarray]
+    _buckets: list[dict[bytes, dict[Any, None]]]
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, max_candidates: int = 200, seed: int = 0) -> None:
+        """Initialize an empty index whose hash functions are drawn with the given seed."""
+        self.num_perm = num_perm
+        self.bands = bands
+        self.max_candidates = max_candidates
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.int64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.int64)
+        self._ids = {}
+        self._signatures = {}
+        self._buckets = [{} for _ in range(bands)]
+
+    def candidate_probability(self, similarity: float) -> float:
+        """Return the probability that two sets with the given Jaccard similarity are candidates for each other.
+
+        Preconditions:
+            - 0 <= similarity <= 1
+        """
+        return 1 - (1 - similarity ** (self.num_perm // self.bands)) ** self.bands
+
+    def signature(self, orders: Iterable) -> np.ndarray:
+        """Return the MinHash signature of the given set of orders.
+
+        Preconditions:
+            - orders is not empty
+        """
+        ids = np.array([self._ids.setdefault(order, len(self._ids)) for order in orders], dtype=np.int64)
+        return ((self._a[:, None] * ids[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray) -> list[bytes]:
+        """Return the bucket key of each band of the given signature."""
+        rows = self.num_perm // self.bands
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def insert(self, key: Any, orders: Iterable) -> None:
+        """Index the given set of orders under key, replacing whatever was indexed under it before.
+
+        An empty set is not indexed, since it is similar to nothing.
+        """
+        self.remove(key)
+        orders = list(orders)
+        if orders:
+            signature = self.signature(orders)
+            self._signatures[key] = signature
+            for buckets, band in zip(self._buckets, self._bands(signature)):
+                buckets.setdefault(band, {})[key] = None
+
+    def remove(self, key: Any) -> None:
+        """Remove the set indexed under key, if there is one."""
+        signature = self._signatures.pop(key, None)
+        if signature is not None:
+            for buckets, band in zip(self._buckets, self._bands(signature)):
+                bucket = buckets[band]
+                bucket.pop(key)
+                if not bucket:
+                    buckets.pop(band)
+
+    def query(self, key: Any) -> list:
+        """Return the keys of the candidates for the set indexed under key, most bands in common first.
+
+        At most max_candidates are returned, and at most that many are looked at in each bucket, so a bucket shared
+        by a huge number of identical sets costs no more than a small one. Return an empty list if nothing is indexed
+        under key.
+        """
+        signature = self._signatures.get(key)
+        if signature is None:
+            return []
+        shared = {}
+        for buckets, band in zip(self._buckets, self._bands(signature)):
+            seen = 0
+            for other in buckets.get(band, ()):
+                if other != key:
+                    shared[other] = shared.get(other, 0) + 1
+                    seen += 1
+                    if seen == self.max_candidates:
+                        break
+        return sorted(shared, key=shared.get, reverse=True)[:self.max_candidates]
+
+
+def jaccard(orders1: Iterable, orders2: Iterable) -> float:
+    """Return the Jaccard similarity of the two given sets of orders, or 0 if both are empty."""
+    orders1, orders2 = set(orders1), set(orders2)
+    union = len(orders1 | orders2)
+    return len(orders1 & orders2) / union if union else 0.0
+
+
+class SimilarGraph(Graph):
+    """A food delivery graph in which each user is matched with at most max_neighbours users, chosen as the users
+    whose repeated orders are most similar to theirs.
+
+    Two users are only ever matched if they share a repeated order, and their edge carries the cuisines of all the
+    repeated orders they share, as in Graph, so every match this graph makes is one Graph would make too. Candidates
+    are found with a MinHashIndex over each user's repeated orders and ranked by their exact Jaccard similarity, so
+    matching a user costs about the same however popular their orders are. Use recall to measure how many of the
+    most similar users each user is matched with.
+
+    Only users with fewer than max_neighbours matches are kept in the index. Otherwise the first users to join a
+    bucket shared by many identical users would be every later user's candidates, and once they had all their matches
+    the later users would find no one.
+
+    Instance Attributes:
+        - max_neighbours: The largest number of users any user is matched with
+        - index: The MinHash index of the repeated orders of every user with room for more matches
+
+    Representation Invariants:
+        - self.max_neighbours > 0
+    """
+    max_neighbours: int
+    index: MinHashIndex
+
+    def __init__(self, max_neighbours: int = 20, num_perm: int = 64, bands: int = 16,
+                 max_candidates: Optional[int] = None, seed: int = 0) -> None:
+        """Initialize an empty graph.
+
+        max_candidates defaults to ten times max_neighbours.
+        """
+        super().__init__()
+        self.max_neighbours = max_neighbours
+        self.index = MinHashIndex(num_perm, bands, max_candidates if max_candidates is not None else
+                                  10 * max_neighbours, seed)
+
+    def _reindex(self, item: Any) -> None:
+        """Update the MinHash index entry of the user with the given item, removing it if they have no room for more
+        matches.
+        """
+        vertex = self.vertices[item]
+        if len(vertex.neighbours) < self.max_neighbours:
+            self.index.insert(item, vertex.repeated_orders)
+        else:
+            self.index.remove(item)
+
+    def index_repeated_orders(self, item: Any) -> None:
+        """Add every repeated order of the user with the given item to the repeated order index and the MinHash index.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        super().index_repeated_orders(item)
+        self._reindex(item)
+
+    def load_classified_orders(self, items: list, one_time: Any, repeated: Any) -> None:
+        """Add the given users and their classified orders to this graph, and index every user's repeated orders."""
+        super().load_classified_orders(items, one_time, repeated)
+        for item in self.vertices:
+            self._reindex(item)
+
+    def restore_user(self, item: Any, one_time_orders: list, repeated_orders: list, matches: list) -> None:
+        """Add the user with the given item to this graph from a record made by user_record, replacing their orders.
+
+        Saved matches are restored in order, but only while both users have room for another match, so restoring
+        never takes anyone past max_neighbours. Matches with users that are not in this graph are skipped. Restoring
+        a user does not mark them as changed.
+        """
+        super().restore_user(item, one_time_orders, repeated_orders, [])
+        neighbours = self.vertices[item].neighbours
+        for other, cuisines in matches:
+            if other not in self.vertices or other == item:
+                continue
+            if other not in neighbours and (len(neighbours) >= self.max_neighbours
+                                            or len(self.vertices[other].neighbours) >= self.max_neighbours):
+                continue
+            for cuisine in cuisines:
+                self._link(item, other, cuisine)
+            self._reindex(other)
+        self._reindex(item)
+
+    def remove_repeated_order(self, item: Any, restaurant: str, cuisine: str) -> None:
+        """Remove the given order from the repeated orders of the user with the given item, if it is one.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+        """
+        super().remove_repeated_order(item, restaurant, cuisine)
+        self._reindex(item)
+
+    def remove_edge(self, item1: Any, item2: Any) -> None:
+        """Remove an edge between the two vertices with the given items in this graph, giving both room for another
+        match.
+
+        Raise a ValueError if item1 or item2 do not appear as vertices in this graph.
+        """
+        super().remove_edge(item1, item2)
+        self._reindex(item1)
+        self._reindex(item2)
+
+    def _shared_cuisines(self, item1: Any, item2: Any) -> list[str]:
+        """Return the cuisines of the repeated orders the two users share, in the order the first repeated them."""
+        repeated = self.vertices[item2].repeated_orders
+        return list(dict.fromkeys(order[1] for order in self.vertices[item1].repeated_orders if order in repeated))
+
+    def most_similar(self, item: Any) -> list[tuple[float, Any]]:
+        """Return (similarity, other) for every candidate the index finds for the given user that shares a repeated
+        order with them, most similar first.
+
+        Only users with room for more matches are found, and none at all if the given user has no room.
+        """
+        repeated = self.vertices[item].repeated_orders
+        similar = []
+        for other in self.index.query(item):
+            similarity = jaccard(repeated, self.vertices[other].repeated_orders)
+            if similarity > 0:
+                similar.append((similarity, other))
+        similar.sort(key=lambda pair: pair[0], reverse=True)
+        return similar
+
+    def _match(self, item: Any) -> list:
+        """Match the user with the given item with the most similar users the index finds for them, until either they
+        have max_neighbours matches or there are no candidates left, and return the items of the new matches.
+        """
+        vertex = self.vertices[item]
+        new_matches = []
+        for _, other in self.most_similar(item):
+            if len(vertex.neighbours) >= self.max_neighbours:
+                break
+            if other not in vertex.neighbours and len(self.vertices[other].neighbours) < self.max_neighbours:
+                for cuisine in self._shared_cuisines(other, item):
+                    self.add_edge(other, item, cuisine)
+                new_matches.append(other)
+                self._reindex(other)
+        self._reindex(item)
+        return new_matches
+
+    def match_users(self, items: Any) -> None:
+        """Match each of the users with the given items, in order, with up to max_neighbours of the most similar users
+        the index finds for them.
+
+        Unlike in Graph, the users matched are marked as changed, since the matches found depend on the order users
+        are matched in.
+        """
+        for item in items:
+            self._match(item)
+
+    @instrumented('similarity.match_all')
+    def match_all(self) -> None:
+        """Match every user, in order, with up to max_neighbours of the most similar users the index finds for them.
+        """
+        for item in self.vertices:
+            self._match(item)
+
+    @instrumented('similarity.record_order')
+    def record_order(self, item: Any, restaurant: str, cuisine: str, rating: Any = 'N/A') -> list:
+        """Add an order to the user with the given item and match them with the most similar users the index finds,
+        up to max_neighbours matches each.
+
+        If the order has just become repeated, the users this user is already matched with that repeated it too have
+        its cuisine added to their edge. Return the items of the users that were newly matched with this user.
+
+        Raise a ValueError if item does not appear as a vertex in this graph.
+
+        Preconditions:
+            - restaurant != ''
+            - cuisine != ''
+        """
+        if not self.add_order(item, restaurant, cuisine, rating):
+            return []
+        order = (restaurant, cuisine)
+        for other in list(self.vertices[item].neighbours):
+            if order in self.vertices[other].repeated_orders:
+                self.add_edge(other, item, cuisine)
+        self._reindex(item)
+        return self._match(item)
+
+
+def recall(graph: SimilarGraph, items: Optional[Iterable] = None) -> float:
+    """Return the fraction of the most similar users of the given users that graph matched them with.
+
+    A user's most similar users are the max_neighbours users sharing a repeated order with them that have the highest
+    Jaccard similarity, found exactly through the repeated order index; a match with a user as similar as the least
+    similar of those counts too, since such ties could be broken either way. items defaults to every user.
+    """
+    found = 0
+    wanted = 0
+    for item in graph.vertices if items is None else items:
+        repeated = graph.vertices[item].repeated_orders
+        others = set()
+        for order in repeated:
+            others.update(graph.get_repeaters(order))
+        others.discard(item)
+        best = sorted((jaccard(repeated, graph.vertices[other].repeated_orders) for other in others),
+                      reverse=True)[:graph.max_neighbours]
+        if best:
+            wanted += len(best)
+            found += min(len(best), sum(1 for other in graph.vertices[item].neighbours
+                                        if jaccard(repeated, graph.vertices[other].repeated_orders) >= best[-1]))
+    return found / wanted if wanted else 1.0
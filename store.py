@@ -0,0 +1,442 @@
+""" PROJECT 2 STORE
+
+This module saves the users of the food delivery graph to an SQLite database, and loads them back.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import contextlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Collection, ContextManager, Optional
+
+from data import Graph, read_user_json
+import instrument
+from instrument import instrumented
+
+logger = logging.getLogger(__name__)
+
+# The longest time, in seconds, the writer waits before retrying a batch that could not be written.
+MAX_RETRY_DELAY = 30.0
+
+
+class GraphStore:
+    """An SQLite database, in WAL mode, holding one record per user of a Graph.
+
+    Saving is write-behind: save_dirty only copies the records of the users that changed since the last save, and a
+    background thread writes them to the database in batches. This keeps disk I/O off the interaction path. Batches
+    are written one at a time, in the order they were taken, whichever thread writes them, so an older record never
+    overwrites a newer one.
+
+    Named checkpoints, such as how far an order log has been applied, and the orders placed (as aggregate.OrderStats.add
+    returns them, so the order statistics can be rebuilt) can be saved with the records. They are written in the same
+    transaction as those records, so a checkpoint is never saved without the changes it stands for.
+
+    If a batch cannot be written (for example because another program has the database locked), it is put back in
+    front of the changes queued since, and the writer retries it after a delay that doubles with every failure.
+
+    Instance Attributes:
+        - filename: The name of the database file
+        - flush_interval: The number of seconds the writer waits to gather changes into a batch before committing it
+        - synchronous: How often SQLite syncs to disk. 'FULL' syncs on every commit, 'NORMAL' only when the WAL is
+        checkpointed, and 'OFF' never
+        - checkpoint_pages: The number of pages the WAL may grow to before it is checkpointed
+
+    Representation Invariants:
+        - self.flush_interval >= 0
+        - self.synchronous in {'OFF', 'NORMAL', 'FULL'}
+        - self.checkpoint_pages > 0
+    """
+    filename: str
+    flush_interval: float
+    synchronous: str
+    checkpoint_pages: int
+    # Private Instance Attributes:
+    #     - _pending:
+    #         The records waiting to be written. Maps a user's item to the latest record saved for them.
+    #     - _writing:
+    #         The records in the batch the writer is currently committing.
+    #     - _pending_checkpoints:
+    #         The checkpoints waiting to be written, mapped from their names.
+    #     - _writing_checkpoints:
+    #         The checkpoints in the batch the writer is currently committing.
+    #     - _pending_orders:
+    #         The orders waiting to be written, oldest first.
+    #     - _writing_orders:
+    #         The orders in the batch the writer is currently committing.
+    #     - _lock:
+    #         Held while _pending or _writing, or their checkpoints or orders, are read or replaced.
+    #     - _write_lock:
+    #         Held while a batch is taken from _pending and written, and while the database is read, so that batches
+    #         are written in order and a reader never misses a record that is between _writing and the database.
+    #     - _wake:
+    #         Set when there are pending records, or when the store is closing.
+    #     - _closing:
+    #         Whether close has been called.
+    #     - _writer:
+    #         The background writer thread, or None if it has not been started.
+    #     - _local:
+    #         Holds each thread's own connection to the database.
+    _pending: dict[Any, tuple[list, list, list]]
+    _writing: dict[Any, tuple[list, list, list]]
+    _pending_checkpoints: dict[str, Any]
+    _writing_checkpoints: dict[str, Any]
+    _pending_orders: list[tuple]
+    _writing_orders: list[tuple]
+    _lock: threading.Lock
+    _write_lock: threading.Lock
+    _wake: threading.Event
+    _closing: bool
+    _writer: Optional[threading.Thread]
+    _local: threading.local
+
+    def __init__(self, filename: str = 'savoursync.db', flush_interval: float = 0.5, synchronous: str = 'NORMAL',
+                 checkpoint_pages: int = 1000) -> None:
+        """Initialize a store for the database with the given filename. Nothing is opened until it is first used."""
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+        self.checkpoint_pages = checkpoint_pages
+        self._pending = {}
+        self._writing = {}
+        self._pending_checkpoints = {}
+        self._writing_checkpoints = {}
+        self._pending_orders = []
+        self._writing_orders = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = False
+        self._writer = None
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection to the database, opening it (and creating the tables) if necessary."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA synchronous={self.synchronous}')
+            connection.execute(f'PRAGMA wal_autocheckpoint={int(self.checkpoint_pages)}')
+            connection.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, one_time_orders TEXT, '
+                               'repeated_orders TEXT, matches TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY, value TEXT)')
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    @instrumented('store.write')
+    def _write(self, records: dict[Any, tuple[list, list, list]], checkpoints: Optional[dict[str, Any]] = None,
+               orders: Optional[list[tuple]] = None) -> None:
+        """Write the given records, checkpoints and orders to the database in a single transaction."""
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?)',
+                                   [(item, json.dumps(one_time), json.dumps(repeated), json.dumps(matches))
+                                    for item, (one_time, repeated, matches) in records.items()])
+            if checkpoints:
+                connection.executemany('INSERT OR REPLACE INTO checkpoints VALUES (?, ?)',
+                                       [(name, json.dumps(value)) for name, value in checkpoints.items()])
+            if orders:
+                connection.executemany('INSERT INTO orders (value) VALUES (?)',
+                                       [(json.dumps(order),) for order in orders])
+
+    def _run(self) -> None:
+        """Write pending records in batches until the store is closed, retrying batches that fail."""
+        delay = 0.0
+        while True:
+            self._wake.wait()
+            if not self._closing:
+                self._wake.clear()
+                time.sleep(max(self.flush_interval, delay))
+            try:
+                self.flush()
+            except (sqlite3.Error, OSError):
+                logger.exception('Could not write to the database %s; retrying', self.filename)
+                instrument.count('store.write_errors')
+                if self._closing:
+                    # close writes what is left itself, and raises if it still cannot.
+                    return
+                delay = min(max(2 * delay, self.flush_interval, 0.1), MAX_RETRY_DELAY)
+                self._wake.set()
+                continue
+            delay = 0.0
+            with self._lock:
+                if self._closing and not (self._pending or self._pending_checkpoints or self._pending_orders):
+                    return
+
+    @instrumented('store.save_dirty')
+    def save_dirty(self, graph: Graph, checkpoints: Optional[dict[str, Any]] = None,
+                   orders: list[tuple] = ()) -> None:
+        """Queue the records of every user in graph that changed since the last save, to be written in the background.
+
+        The given checkpoints, mapped from their names, and the given newly placed orders are queued with them, and are
+        written in the same transaction as the records. Only in-memory copies of the records are made here; the
+        database is written by the background writer.
+        """
+        records = {item: graph.user_record(item) for item in graph.take_dirty() if item in graph.vertices}
+        if not records and not checkpoints and not orders:
+            return
+        with self._lock:
+            self._pending.update(records)
+            self._pending_checkpoints.update(checkpoints or {})
+            self._pending_orders.extend(orders)
+            if self._writer is None and not self._closing:
+                self._writer = threading.Thread(target=self._run, daemon=True)
+                self._writer.start()
+        self._wake.set()
+
+    def flush(self) -> None:
+        """Write every pending record, checkpoint and order now, in the calling thread, after any batch that is already
+        being written.
+
+        If the batch cannot be written, it is queued again and the error is raised.
+        """
+        with self._write_lock:
+            with self._lock:
+                self._writing, self._pending = self._pending, {}
+                self._writing_checkpoints, self._pending_checkpoints = self._pending_checkpoints, {}
+                self._writing_orders, self._pending_orders = self._pending_orders, []
+            try:
+                if self._writing or self._writing_checkpoints or self._writing_orders:
+                    self._write(self._writing, self._writing_checkpoints, self._writing_orders)
+            except BaseException:
+                # Nothing in the batch was written, so it is queued again, under the newer changes queued since.
+                with self._lock:
+                    self._pending = {**self._writing, **self._pending}
+                    self._pending_checkpoints = {**self._writing_checkpoints, **self._pending_checkpoints}
+                    self._pending_orders = self._writing_orders + self._pending_orders
+                raise
+            finally:
+                with self._lock:
+                    self._writing = {}
+                    self._writing_checkpoints = {}
+                    self._writing_orders = []
+
+    def close(self) -> None:
+        """Write every pending record, checkpoint and order, and stop the background writer."""
+        with self._lock:
+            self._closing = True
+            writer = self._writer
+        self._wake.set()
+        if writer is not None:
+            writer.join()
+        self.flush()
+
+    @instrumented('store.save_all')
+    def save_all(self, graph: Graph) -> None:
+        """Write the record of every user in graph now, in a single transaction.
+        """
+        graph.take_dirty()
+        records = {item: graph.user_record(item) for item in graph.vertices}
+        with self._write_lock:
+            self._write(records)
+
+    def _read(self, item: Any) -> Optional[tuple[list, list, list]]:
+        """Return the latest saved record of the user with the given item, or None if they have never been saved."""
+        with self._write_lock:
+            with self._lock:
+                if item in self._pending:
+                    return self._pending[item]
+                if item in self._writing:
+                    return self._writing[item]
+            row = self._connection().execute('SELECT one_time_orders, repeated_orders, matches FROM users '
+                                             'WHERE id = ?', (item,)).fetchone()
+        return None if row is None else (json.loads(row[0]), json.loads(row[1]), json.loads(row[2]))
+
+    def has_user(self, item: Any) -> bool:
+        """Return whether the user with the given item has been saved, including if they have not been written yet."""
+        with self._write_lock:
+            with self._lock:
+                if item in self._pending or item in self._writing:
+                    return True
+            return self._connection().execute('SELECT 1 FROM users WHERE id = ?', (item,)).fetchone() is not None
+
+    def checkpoint(self, name: str) -> Any:
+        """Return the latest value saved for the checkpoint with the given name, or None if it has never been saved."""
+        with self._write_lock:
+            with self._lock:
+                for checkpoints in (self._pending_checkpoints, self._writing_checkpoints):
+                    if name in checkpoints:
+                        return checkpoints[name]
+            row = self._connection().execute('SELECT value FROM checkpoints WHERE name = ?', (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def orders(self) -> list[tuple]:
+        """Return every order saved with save_dirty, oldest first, including those not written yet."""
+        with self._write_lock:
+            rows = self._connection().execute('SELECT value FROM orders ORDER BY id').fetchall()
+            with self._lock:
+                unwritten = self._writing_orders + self._pending_orders
+        return [tuple(json.loads(value)) for value, in rows] + [tuple(order) for order in unwritten]
+
+    @instrumented('store.load_user')
+    def load_user(self, graph: Graph, item: Any) -> bool:
+        """Restore the user with the given item into graph. Return whether they had been saved.
+        """
+        record = self._read(item)
+        if record is None:
+            return False
+        graph.restore_user(item, *record)
+        return True
+
+    def records(self, items: Optional[Collection] = None) -> dict[Any, tuple[list, list, list]]:
+        """Return the latest saved record of every user, or only of the users with the given items, mapped from their
+        item, including those not written yet. Users that have never been saved are left out.
+        """
+        query = 'SELECT id, one_time_orders, repeated_orders, matches FROM users'
+        with self._write_lock:
+            connection = self._connection()
+            if items is None:
+                rows = connection.execute(query).fetchall()
+            else:
+                items = list(items)
+                rows = []
+                # SQLite limits how many parameters a statement may have, so long lists are looked up in chunks.
+                for i in range(0, len(items), 500):
+                    chunk = items[i:i + 500]
+                    rows.extend(connection.execute(f'{query} WHERE id IN ({", ".join("?" * len(chunk))})',
+                                                   chunk).fetchall())
+            with self._lock:
+                unwritten = {**self._writing, **self._pending}
+        if items is not None:
+            unwritten = {item: unwritten[item] for item in items if item in unwritten}
+        records = {item: (json.loads(one_time), json.loads(repeated), json.loads(matches))
+                   for item, one_time, repeated, matches in rows}
+        records.update(unwritten)
+        return records
+
+    def saved_items(self) -> set:
+        """Return the items of every user that has been saved, including those not written yet."""
+        with self._write_lock:
+            rows = self._connection().execute('SELECT id FROM users').fetchall()
+            with self._lock:
+                items = {*self._writing, *self._pending}
+        items.update(item for item, in rows)
+        return items
+
+    @instrumented('store.load_all')
+    def load_all(self, graph: Graph) -> int:
+        """Restore every saved user into graph, and return how many there were.
+
+        All users are added before any matches are, so that matches between two saved users are restored too.
+        """
+        records = self.records()
+        for item, (one_time, repeated, _) in records.items():
+            graph.restore_user(item, one_time, repeated, [])
+        for item, (one_time, repeated, matches) in records.items():
+            graph.restore_user(item, one_time, repeated, matches)
+        return len(records)
+
+
+def find_user_files(directory: str = '.') -> list[str]:
+    """Return the paths of the files in the given directory that Graph.save_to_json saved users to.
+
+    Those files are named after the user's id, with no extension.
+    """
+    with os.scandir(directory) as entries:
+        return [entry.path for entry in entries if entry.name.isdigit() and entry.is_file()]
+
+
+def new_userid(graph: Graph, store: Optional[GraphStore] = None, directory: Optional[str] = '.') -> int:
+    """Return a random userid that no user in graph, in store or in the user files in directory has.
+
+    Saved users are checked as well as those in graph, since they are not in it until they log in or are preloaded,
+    and giving their id to a new user would overwrite their saved data. Pass None as the store or directory to skip it.
+    """
+    while True:
+        userid = random.randint(1000, 999999)
+        if userid in graph.vertices or (store is not None and store.has_user(userid)):
+            continue
+        if directory is None or not os.path.isfile(os.path.join(directory, str(userid))):
+            return userid
+
+
+def _read_user_files(filenames: list[str]) -> list[tuple[int, list, list, Any]]:
+    """Return the users saved to the given files, skipping any file that cannot be read."""
+    users = []
+    for filename in filenames:
+        try:
+            users.append(read_user_json(filename))
+        except (OSError, ValueError, KeyError):
+            pass
+    return users
+
+
+@instrumented('store.preload_users')
+def preload_users(graph: Graph, store: Optional[GraphStore] = None, directory: Optional[str] = '.',
+                  threads: int = 8, batch: int = 500, lock: Optional[ContextManager] = None) -> dict[str, Any]:
+    """Restore every saved user into graph, from the user files in directory and from store, then match them.
+
+    The user files are parsed by a pool of threads, in batches of the given size, while the store is asked which
+    users it holds. A user saved in both is restored from the store, since that is where changes are saved now. Users
+    are restored in batches of the given size, without their saved matches, and then matched in batches with everyone
+    they share a repeated order with. Their saved matches are not needed for this: every match is made on a shared
+    repeated order, and removing a match removes the order it was made on. Nobody is marked as changed.
+
+    Nothing is parsed while holding lock, if one is given: it is only held while a batch is restored or matched, so
+    other threads can use graph in between. Each batch reads its users' store records while holding it, so a user
+    who changed after the preload started is restored as they are now, not as they were saved before.
+
+    Return how many users were restored from each source and how many seconds each step took, which are also recorded
+    as metrics. Pass None as the directory or store to skip it.
+
+    Preconditions:
+        - threads > 0
+        - batch > 0
+    """
+    if lock is None:
+        lock = contextlib.nullcontext()
+    start = time.perf_counter()
+    users = {}
+    files = find_user_files(directory) if directory is not None else []
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='preload') as executor:
+        parsed = executor.map(_read_user_files, [files[i:i + batch] for i in range(0, len(files), batch)])
+        saved = store.saved_items() if store is not None else set()
+        for batch_users in parsed:
+            for item, one_time, repeated, _ in batch_users:
+                users[item] = (one_time, repeated)
+    from_files = len(users)
+    for item in saved:
+        users.setdefault(item, None)
+    items = list(users)
+    read = time.perf_counter()
+
+    from_store = 0
+    for i in range(0, len(items), batch):
+        chunk = items[i:i + batch]
+        with lock:
+            records = store.records(chunk) if store is not None else {}
+            from_store += len(records)
+            for item in chunk:
+                record = records[item][:2] if item in records else users[item]
+                if record is not None:
+                    graph.restore_user(item, *record, [])
+    restored = time.perf_counter()
+    for i in range(0, len(items), batch):
+        with lock:
+            graph.match_users(items[i:i + batch])
+    matched = time.perf_counter()
+
+    loaded = {'users': len(users),
+              'user_files': from_files,
+              'store_records': from_store,
+              'read_s': read - start,
+              'restore_s': restored - read,
+              'match_s': matched - restored,
+              'total_s': matched - start}
+    if instrument.ENABLED:
+        instrument.count('store.preload_users.users', len(users))
+        for step in ('read', 'restore', 'match'):
+            instrument.record(f'store.preload_users.{step}', loaded[f'{step}_s'])
+    return loaded
@@ -0,0 +1,229 @@
+""" PROJECT 2 STREAM
+
+This module follows an append-only log of new orders and applies them to the running graph as they arrive, matching
+users incrementally instead of rebuilding the graph.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import csv
+import json
+import logging
+import os
+import threading
+from typing import Any, Optional
+
+from data import GraphService
+import instrument
+from instrument import instrumented
+from store import GraphStore
+
+logger = logging.getLogger(__name__)
+
+
+class OrderStream:
+    """Follows an order log and applies every new order in it to the graph of a GraphService.
+
+    The log is either a CSV file with the same header as food_order.csv, or (if its name ends in .ndjson or .jsonl) a
+    file of JSON objects with the same keys, one per line. Only complete lines are read, so a line that is still being
+    written is picked up on a later poll. A line that cannot be read as an order is logged and skipped. If the log
+    becomes shorter than what has been read, it is taken to have been replaced, and is read again from its start.
+
+    If a store is given, after every chunk the offset of the next unread byte is saved in it as a checkpoint, in the
+    same transaction as the users and orders the chunk changed, so a restarted stream resumes where it left off and
+    every order has been applied exactly once: either a chunk's changes and its checkpoint were both saved, or neither
+    was and the chunk is applied again. The saved users must be loaded back (for example with store.preload_users)
+    before the stream is started. Without a store nothing the stream changes outlives the program, so no checkpoint is
+    saved either, and the log is read from its start every time.
+
+    Instance Attributes:
+        - filename: The name of the order log
+        - service: The service whose graph the orders are applied to
+        - store: The store the changed users and the checkpoint are saved to after every chunk, or None to not save
+        the users
+        - checkpoint: The name the offset into the log is saved under in the store
+        - chunk_size: The largest number of orders applied at once
+        - poll_interval: The number of seconds to wait before checking the log again once it has been read to the end
+
+    Representation Invariants:
+        - self.chunk_size > 0
+        - self.poll_interval > 0
+    """
+    filename: str
+    service: GraphService
+    store: Optional[GraphStore]
+    checkpoint: str
+    chunk_size: int
+    poll_interval: float
+    # Private Instance Attributes:
+    #     - _offset:
+    #         The offset of the first byte of the log that has not been applied yet.
+    #     - _columns:
+    #         The column names from the header of a CSV log, or None if it has not been read yet.
+    #     - _stop:
+    #         Set to stop the background thread.
+    _offset: int
+    _columns: Optional[list[str]]
+    _stop: threading.Event
+
+    def __init__(self, filename: str, service: GraphService, store: Optional[GraphStore] = None,
+                 checkpoint: Optional[str] = None, chunk_size: int = 1000, poll_interval: float = 1.0) -> None:
+        """Initialize a stream of the given log, resuming from its checkpoint if there is one.
+
+        The checkpoint defaults to the log's name followed by .checkpoint.
+        """
+        self.filename = filename
+        self.service = service
+        self.store = store
+        self.checkpoint = checkpoint if checkpoint is not None else filename + '.checkpoint'
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self._columns = None
+        self._stop = threading.Event()
+        self._offset = (store.checkpoint(self.checkpoint) or 0) if store is not None else 0
+
+    @property
+    def offset(self) -> int:
+        """The offset of the first byte of the log that has not been applied yet."""
+        return self._offset
+
+    def _is_json(self) -> bool:
+        """Return whether the log holds JSON lines rather than CSV."""
+        return self.filename.endswith(('.ndjson', '.jsonl'))
+
+    def _parse(self, lines: list[bytes]) -> list[tuple[Any, str, str, str, dict[str, Any]]]:
+        """Return the (customer, restaurant, cuisine, rating, measures) of the order on each of the given lines of the
+        log, where measures holds the arguments of OrderStats.add the order has beyond the first three.
+
+        Blank lines are skipped, and so are lines that cannot be read as an order, which are logged. Ratings are kept
+        as strings, as they are everywhere else orders come from.
+        """
+        orders = []
+        for line in lines:
+            try:
+                text = line.decode()
+                if not text.strip():
+                    continue
+                if self._is_json():
+                    row = json.loads(text)
+                else:
+                    values = next(csv.reader([text]))
+                    if len(values) != len(self._columns):
+                        raise ValueError(f'expected {len(self._columns)} columns, not {len(values)}')
+                    row = dict(zip(self._columns, values))
+                day = row.get('day_of_the_week')
+                measures = {'cost': row.get('cost_of_the_order'),
+                            'preparation_time': row.get('food_preparation_time'),
+                            'delivery_time': row.get('delivery_time'),
+                            'weekend': None if day is None else day == 'Weekend'}
+                orders.append((int(row['customer_id']), str(row['restaurant_name']), str(row['cuisine_type']),
+                               str(row.get('rating', 'N/A')), measures))
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                logger.warning('Skipping a line of %s that is not an order (%s): %r', self.filename, error, line)
+                instrument.count('stream.skipped_lines')
+        return orders
+
+    @instrumented('stream.apply')
+    def _apply(self, orders: list[tuple[Any, str, str, str, dict[str, Any]]], offset: int) -> None:
+        """Add the given orders to the graph, the menu and the order statistics, matching users as their orders become
+        repeated, and queue the changed users and the orders to be saved with offset as the checkpoint, if there is a
+        store.
+        """
+        graph = self.service.graph
+        menu = self.service.menu
+        stats = self.service.stats
+        with self.service.lock:
+            placed = []
+            for customer, restaurant, cuisine, rating, measures in orders:
+                # The menu is updated first, so a restaurant the order makes active is searchable by this cuisine.
+                cuisines = menu.setdefault(restaurant, set())
+                if cuisine not in cuisines:
+                    cuisines.add(cuisine)
+                    if graph.restaurant_index is not None:
+                        graph.restaurant_index.refresh(restaurant)
+                graph.add_vertex(customer)
+                graph.record_order(customer, restaurant, cuisine, rating)
+                placed.append(stats.add(restaurant, cuisine, rating, **measures))
+            if self.store is not None:
+                self.store.save_dirty(graph, {self.checkpoint: offset}, placed)
+
+    def poll(self) -> int:
+        """Apply every complete order added to the log since the last poll, in chunks, and return how many there were.
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> history, log = os.path.join(directory, 'history.csv'), os.path.join(directory, 'log.csv')
+        >>> header = 'customer_id,restaurant_name,cuisine_type,rating\\n'
+        >>> with open(history, 'w') as file:
+        ...     _ = file.write(header + '1,Shake Shack,American,5\\n')
+        >>> with open(log, 'w') as file:
+        ...     _ = file.write(header + '2,Shake Shack,American,4\\nnobody,Shake Shack,American,4\\n')
+        >>> stream = OrderStream(log, GraphService(history, snapshot=None))
+        >>> stream.poll()  # The second order has no customer id, so it is skipped.
+        1
+        >>> with open(log, 'w') as file:  # The log is replaced by a shorter one, header and all.
+        ...     _ = file.write(header + '3,Shake Shack,American,3\\n')
+        >>> stream.poll()
+        1
+        >>> sorted(stream.service.graph.vertices)
+        [1, 2, 3]
+        """
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return 0
+        if size < self._offset:
+            # The log was truncated or replaced, so start again from its beginning, header included.
+            self._offset = 0
+            self._columns = None
+        applied = 0
+        with open(self.filename, 'rb') as file:
+            if not self._is_json() and self._columns is None:
+                header = file.readline()
+                if not header.endswith(b'\n'):
+                    return 0
+                self._columns = next(csv.reader([header.decode()]))
+                self._offset = max(self._offset, len(header))
+            file.seek(self._offset)
+            while True:
+                lines = []
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    lines.append(line)
+                    if len(lines) == self.chunk_size:
+                        break
+                if not lines:
+                    return applied
+                orders = self._parse(lines)
+                offset = self._offset + sum(len(line) for line in lines)
+                # Even a chunk with no readable orders is applied, so its checkpoint moves past the lines skipped.
+                self._apply(orders, offset)
+                applied += len(orders)
+                self._offset = offset
+                file.seek(self._offset)
+
+    def run(self) -> None:
+        """Poll the log until stop is called. An error while polling is logged, and the log is polled again later."""
+        while not self._stop.is_set():
+            try:
+                applied = self.poll()
+            except Exception:
+                logger.exception('Could not apply the orders in %s', self.filename)
+                applied = 0
+            if applied == 0:
+                self._stop.wait(self.poll_interval)
+
+    def start(self) -> threading.Thread:
+        """Start following the log in a background thread, and return the thread."""
+        self._stop.clear()
+        thread = threading.Thread(target=self.run, name='order-stream', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Stop following the log after the current chunk."""
+        self._stop.set()
@@ -0,0 +1,117 @@
+""" PROJECT 2 WIDGETS
+
+This module holds the Tkinter widgets SavourSync builds its windows from that Tkinter does not provide itself.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+from tkinter import Frame, Label, Scrollbar, Misc, BOTH, LEFT, RIGHT, VERTICAL, W, X, Y
+from typing import Any, Callable, Optional
+
+
+class VirtualList(Frame):
+    """A scrollable list of items that only has widgets for the rows on screen.
+
+    A fixed number of row labels is made once, and scrolling changes which items they show instead of moving
+    widgets, so showing a list takes the same time however many items it has.
+
+    Instance Attributes:
+        - rows: The number of rows shown at once
+        - items: The items in the list
+        - first: The index in items of the item shown in the top row
+        - on_select: Called with an item when its row is clicked, if not None
+        - describe: Returns the text shown for an item
+
+    Representation Invariants:
+        - self.rows > 0
+        - 0 <= self.first <= max(len(self.items) - self.rows, 0)
+    """
+    rows: int
+    items: list
+    first: int
+    on_select: Optional[Callable[[Any], None]]
+    describe: Callable[[Any], str]
+    # Private Instance Attributes:
+    #     - _labels:
+    #         The row labels, top row first.
+    #     - _scrollbar:
+    #         The scrollbar beside the rows.
+    _labels: list[Label]
+    _scrollbar: Scrollbar
+
+    def __init__(self, parent: Misc, rows: int = 15, width: int = 50,
+                 on_select: Optional[Callable[[Any], None]] = None,
+                 describe: Callable[[Any], str] = str) -> None:
+        """Initialize an empty list inside parent showing the given number of rows, each the given number of
+        characters wide.
+
+        Preconditions:
+            - rows > 0
+        """
+        super().__init__(parent)
+        self.rows = rows
+        self.items = []
+        self.first = 0
+        self.on_select = on_select
+        self.describe = describe
+
+        self._scrollbar = Scrollbar(self, orient=VERTICAL, command=self._scroll)
+        self._scrollbar.pack(side=RIGHT, fill=Y)
+        body = Frame(self)
+        body.pack(side=LEFT, fill=BOTH, expand=True)
+        self._labels = []
+        for row in range(rows):
+            label = Label(body, width=width, anchor=W)
+            label.pack(fill=X)
+            label.bind('<Button-1>', lambda event, r=row: self._select(r))
+            self._labels.append(label)
+
+        for widget in [self, body] + self._labels:
+            widget.bind('<MouseWheel>', lambda event: self.scroll_by(-1 if event.delta > 0 else 1))
+            widget.bind('<Button-4>', lambda event: self.scroll_by(-1))
+            widget.bind('<Button-5>', lambda event: self.scroll_by(1))
+        self._redraw()
+
+    def set_items(self, items: list) -> None:
+        """Show the given items, scrolled to the top."""
+        self.items = items
+        self.first = 0
+        self._redraw()
+
+    def scroll_to(self, first: int) -> None:
+        """Scroll so the item at the given index is in the top row, or as close to it as the list allows."""
+        self.first = max(0, min(first, len(self.items) - self.rows))
+        self._redraw()
+
+    def scroll_by(self, rows: int) -> None:
+        """Scroll down by the given number of rows, or up if it is negative."""
+        self.scroll_to(self.first + rows)
+
+    def _scroll(self, action: str, amount: str, unit: Optional[str] = None) -> None:
+        """Scroll as the scrollbar asks, which is either ('moveto', fraction) or ('scroll', count, 'units' or
+        'pages').
+        """
+        if action == 'moveto':
+            self.scroll_to(round(float(amount) * len(self.items)))
+        elif unit == 'pages':
+            self.scroll_by(int(amount) * self.rows)
+        else:
+            self.scroll_by(int(amount))
+
+    def _select(self, row: int) -> None:
+        """Call on_select with the item shown in the given row, if there is one."""
+        if self.on_select is not None and self.first + row < len(self.items):
+            self.on_select(self.items[self.first + row])
+
+    def _redraw(self) -> None:
+        """Show the items from first onwards in the row labels, and move the scrollbar to match."""
+        for row, label in enumerate(self._labels):
+            index = self.first + row
+            label.configure(text=self.describe(self.items[index]) if index < len(self.items) else '')
+        if len(self.items) <= self.rows:
+            self._scrollbar.set(0.0, 1.0)
+        else:
+            self._scrollbar.set(self.first / len(self.items), (self.first + self.rows) / len(self.items))
@@ -0,0 +1,129 @@
+""" PROJECT 2 WORKER
+
+This module runs slow graph work away from the Tk event loop, so that the window keeps responding while it runs.
+
+Copyright and Usage Information
+===============================
+
+This file is Copyright Abeera Fatima and Amal Nouman Irshad.
+"""
+from __future__ import annotations
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Optional
+from tkinter import Misc
+
+
+class TkWorker:
+    """Runs tasks on a background thread and hands their results back to callbacks on the Tk thread.
+
+    Tasks run one at a time, each inside a with statement on lock, so a task never changes the graph while another
+    thread is using it. Tk widgets may only be touched from the Tk thread, so finished tasks are put on a queue that
+    the Tk thread polls with root.after, and their callbacks are called from there.
+
+    Instance Attributes:
+        - root: The Tk widget whose event loop the callbacks run on
+        - lock: The lock held while each task runs
+        - poll_ms: How often, in milliseconds, finished tasks are checked for while any are outstanding
+    """
+    root: Misc
+    lock: ContextManager
+    poll_ms: int
+    # Private Instance Attributes:
+    #     - _executor:
+    #         The single background thread tasks run on.
+    #     - _finished:
+    #         Finished tasks waiting for their callbacks to be called, as (future, on_done) pairs.
+    #     - _current:
+    #         The submitted tasks whose callbacks cancel_all should drop, mapped to whether cancel_all may also skip
+    #         the task itself.
+    #     - _dropped:
+    #         Tasks that were running or bound to run when they were cancelled, whose callbacks must not be called.
+    #     - _outstanding:
+    #         The number of submitted tasks whose callbacks have not been called or dropped yet.
+    #     - _polling:
+    #         Whether a call to _poll is scheduled.
+    _executor: ThreadPoolExecutor
+    _finished: queue.Queue
+    _current: dict[Future, bool]
+    _dropped: set[Future]
+    _outstanding: int
+    _polling: bool
+
+    def __init__(self, root: Misc, lock: ContextManager, poll_ms: int = 50) -> None:
+        """Initialize a worker delivering results on the given root's event loop."""
+        self.root = root
+        self.lock = lock
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='graph-worker')
+        self._finished = queue.Queue()
+        self._current = {}
+        self._dropped = set()
+        self._outstanding = 0
+        self._polling = False
+
+    def submit(self, task: Callable[[], Any], on_done: Optional[Callable[[Any], None]] = None,
+               cancellable: bool = True) -> Future:
+        """Run task in the background, then call on_done with its result on the Tk thread.
+
+        cancel_all always stops on_done from being called. If cancellable, it also skips the task if it has not
+        started; otherwise the task still runs. Tasks that change the graph should not be cancellable, so that leaving
+        a screen never leaves a change half made or not made at all.
+
+        Preconditions:
+            - this method is called from the Tk thread
+        """
+        future = self._executor.submit(self._run, task)
+        self._current[future] = cancellable
+        future.add_done_callback(lambda done: self._finished.put((done, on_done)))
+        self._outstanding += 1
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+        return future
+
+    def cancel_all(self) -> None:
+        """Drop the callback of every task that has not had it called yet, and skip the cancellable ones among them
+        that have not started.
+
+        Preconditions:
+            - this method is called from the Tk thread
+        """
+        for future, cancellable in self._current.items():
+            if not (cancellable and future.cancel()):
+                self._dropped.add(future)
+        self._current.clear()
+
+    def close(self) -> None:
+        """Wait for every submitted task to finish running. No more callbacks are called after this.
+        """
+        self._executor.shutdown(wait=True)
+
+    def _run(self, task: Callable[[], Any]) -> Any:
+        """Run task while holding the lock."""
+        with self.lock:
+            return task()
+
+    def _poll(self) -> None:
+        """Call the callbacks of every finished task, and poll again later if any are still outstanding."""
+        while True:
+            try:
+                future, on_done = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._outstanding -= 1
+            self._current.pop(future, None)
+            dropped = future in self._dropped
+            self._dropped.discard(future)
+            if future.cancelled():
+                continue
+            # A task whose callback was dropped may still have changed the graph, so its errors are still reported.
+            error = future.exception()
+            if error is not None:
+                self.root.report_callback_exception(type(error), error, error.__traceback__)
+            elif on_done is not None and not dropped:
+                on_done(future.result())
+        if self._outstanding > 0:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False